@@ -0,0 +1,174 @@
+"""
+Benchmarks for the Templite template engine.
+
+Measures compile time, render time and the memory allocated while
+rendering for a set of typical templates, and compares the results with a
+saved baseline:
+
+    python benchmarks/bench_templite.py --save benchmarks/baseline.json
+    python benchmarks/bench_templite.py --compare benchmarks/baseline.json
+
+A comparison exits with status 1 when a timing got slower than the
+baseline by more than the threshold. Baselines depend on the machine, so
+compare with one saved on the same machine, and raise --repeat when the
+timings are noisy.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pypette import TemplateEngine, TemplateLoader, Templite  # noqa: E402
+
+
+class Node:
+    def __init__(self, name, child):
+        self.name = name
+        self.child = child
+
+
+def nested(depth):
+    """Alternate objects and dicts, `depth` levels deep."""
+    child = nested(depth - 1) if depth else None
+    if depth % 2:
+        return Node(f"node{depth}", child)
+    return {"name": f"node{depth}", "child": child}
+
+
+ROWS = [{"id": i, "name": f"row {i}", "email": f"user{i}@example.com",
+         "active": i % 3 == 0} for i in range(10000)]
+
+TABLE = ("<table>{% for row in rows %}<tr><td>{{ row.id }}</td><td>{{ row.name }}</td>"
+         "<td>{{ row.email }}</td>{% if row.active %}<td>yes</td>{% else %}<td>no</td>"
+         "{% endif %}</tr>{% endfor %}</table>")
+
+
+def scenarios(template_dir):
+    """Yield ``(name, make_template, context)`` for every benchmark."""
+    names = [f"var{i}" for i in range(200)]
+    yield ("many_vars",
+           lambda: Templite("".join(f"<p>{{{{ {name} }}}}</p>" for name in names)),
+           {name: name for name in names})
+
+    yield ("deep_dots",
+           lambda: Templite("{% for i in items %}{{ tree.child.child.child.child.child.name }}"
+                            "{{ tree.child.child.name }}{% endfor %}"),
+           {"tree": nested(6), "items": range(1000)})
+
+    yield ("big_loop", lambda: Templite(TABLE), {"rows": ROWS})
+
+    yield ("filters",
+           lambda: Templite("{% for row in rows %}{{ row.name|upper|lower }}"
+                            "{{ row.email|upper|lower|strip }}{% endfor %}"),
+           {"rows": ROWS[:2000], "upper": str.upper, "lower": str.lower, "strip": str.strip})
+
+    with open(os.path.join(template_dir, "row.html"), "w") as f:
+        f.write("<tr><td>{{ user.name }}</td><td>{% include 'cell.html' %}</td></tr>")
+    with open(os.path.join(template_dir, "cell.html"), "w") as f:
+        f.write("<span>{{ title }}</span>")
+    loader = TemplateLoader(template_dir)
+    yield ("includes",
+           lambda: Templite("{% for row in rows %}{% include 'row.html' %}{% endfor %}", loader),
+           {"rows": ROWS[:2000], "user": {"name": "admin"}, "title": "Users"})
+
+    with open(os.path.join(template_dir, "table.html"), "w") as f:
+        f.write(TABLE)
+    # Here compile_ms is the time of a load served by the engine's cache
+    engine = TemplateEngine(loader)
+    engine.load("table.html")
+    yield ("engine_load", lambda: engine.load("table.html"), {"rows": ROWS[:100]})
+
+
+def best_of(func, repeat):
+    """Return the best time of `func` in ms, timing enough calls for 0.1s."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, number // 2)
+    return min(timer.repeat(repeat, number)) / number * 1000
+
+
+def allocated(func):
+    """Return the peak of memory allocated while calling `func`, in KiB."""
+    tracemalloc.start()
+    try:
+        func()
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (peak - before) / 1024
+
+
+def run(repeat):
+    results = {}
+    with tempfile.TemporaryDirectory() as template_dir:
+        for name, make_template, context in scenarios(template_dir):
+            template = make_template()
+            render = lambda: template.render(context)  # noqa: E731
+            results[name] = {
+                "compile_ms": round(best_of(make_template, repeat), 4),
+                "render_ms": round(best_of(render, repeat), 4),
+                "render_alloc_kib": round(allocated(render), 1),
+                "output_chars": len(render()),
+            }
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change of every timing and return the regressions."""
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            before = baseline.get(name, {}).get(metric)
+            if not before or metric == "output_chars":
+                continue
+            change = (value - before) / before
+            flag = ""
+            if metric.endswith("_ms") and change > threshold:
+                regressions.append(f"{name}.{metric}")
+                flag = "  <-- regression"
+            print(f"{name:12} {metric:17} {before:10.3f} -> {value:10.3f} {change:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--save", metavar="FILE", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare with a JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown reported as a regression (default: 0.2)")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repetitions (default: 5)")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions: {', '.join(regressions)}")
+            return 1
+    else:
+        for name, metrics in results.items():
+            print(f"{name:12} " + "  ".join(f"{k}={v}" for k, v in metrics.items()))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": platform.python_version(),
+                       "implementation": platform.python_implementation(),
+                       "results": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -86,9 +86,8 @@ def view_with_template_2(request):
 
 @app.route('/upload', method='POST')
 def upload(request):
-    test = request.files['test.txt'] 
-    content = test['content']
-    return {"content": content.decode()}
+    test = request.files['test.txt']
+    return {"filename": test.filename, "content": test.read().decode()}
 
 @app.route("/static/:filename", method='GET')
 def static(request, filename):
@@ -46,7 +46,7 @@ class CORSPlugin:
             if isinstance(response, str):
                 response = HTTPResponse(body=response)
 
-            request_origin = request.headers.get('Origin')
+            request_origin = request.origin
             
             if self.is_origin_allowed(request_origin):
                 # If origin is allowed, reflect the requesting origin
@@ -7,13 +7,12 @@ License: MIT (see LICENSE for details)
 """
 from __future__ import annotations
 
-import base64, email, hashlib, hmac, http.cookies, http, io, mimetypes, json, pickle, re, os, time, traceback, urllib.parse, wsgiref
-import wsgiref.headers
+import base64, collections, datetime, email, functools, hashlib, hmac, http.cookies, http, importlib.util, io, itertools, marshal, mimetypes, json, pickle, re, os, shutil, sys, tempfile, threading, types, time, traceback, urllib.parse, uuid, wsgiref, zlib
 import wsgiref.util
 from urllib.parse import urljoin
 from email.utils import parsedate_to_datetime
 from email.parser import HeaderParser
-from typing import Optional
+from typing import Any, Callable, Iterator, Optional
 
 PLAIN_TEXT = ('Content-Type', 'text/plain')
 
@@ -28,6 +27,87 @@ def parse_date(date_str: str) -> Optional[int]:
     except (TypeError, ValueError, IndexError):
         return None
 
+def _parse_accept_encoding(header: str) -> dict[str, float]:
+    """Parse an Accept-Encoding header into ``{coding: quality}``."""
+    codings = {}
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        codings[coding] = quality
+    return codings
+
+def _query_kwargs(query: dict[str, list[str]]) -> dict[str, str]:
+    """
+    Reduce a parsed query string to handler keyword arguments, keeping the
+    last non blank value of every parameter.
+    """
+    kwargs = {}
+    for name, values in query.items():
+        for value in values:
+            if value:
+                kwargs[name] = value
+    return kwargs
+
+class LRUCache:
+    """
+    A bounded mapping which evicts the least recently used entry, shared
+    by threads.
+
+    Args:
+        maxsize (int): The maximum number of entries to keep.
+
+    The `hits` and `misses` counters are updated by `get` and can be used
+    to size the cache.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """Return the value for `key` and mark it as recently used."""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store `value`, evicting the oldest entry if the cache is full."""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries. The counters are kept."""
+        with self._lock:
+            self._data.clear()
+
+
 class TempliteSyntaxError(ValueError):
     pass
 
@@ -86,6 +166,175 @@ class TemplateLoader:
         with open(template_path, 'r', encoding='utf-8') as f:
             return f.read()
 
+    def mtime(self, template_name: str) -> int:
+        """Return the modification time of the template file in ns."""
+        try:
+            return os.stat(os.path.join(self.base_path, template_name)).st_mtime_ns
+        except OSError:
+            raise FileNotFoundError(
+                    f"Template {template_name} not found in {self.base_path}.")
+
+class TemplateBytecodeCache:
+    """
+    Keep the compiled code of templates in `directory`, so that new worker
+    processes load it instead of compiling every template again.
+
+    Entries are keyed by a hash of the template source and named after the
+    Python version, whose bytecode they hold. Bump `format_version` when
+    the code generated for templates changes.
+    """
+    format_version = 4
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _path(self, source: str, options: tuple[str, ...] = ()) -> str:
+        key = f"{self.format_version}\0{','.join(options)}\0{source}"
+        key = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.{sys.implementation.cache_tag}.tplc")
+
+    def load(self, source: str,
+             options: tuple[str, ...] = ()) -> tuple[types.CodeType, list[str]] | None:
+        """
+        Return the cached code and include names for `source` compiled with
+        `options`, if any.
+        """
+        try:
+            with open(self._path(source, options), "rb") as f:
+                magic, code, include_names = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if magic != importlib.util.MAGIC_NUMBER:
+            return None
+        return code, list(include_names)
+
+    def dump(self, source: str, code: types.CodeType, include_names: list[str],
+             options: tuple[str, ...] = ()) -> None:
+        """Store the compiled `code` of `source`."""
+        path = self._path(source, options)
+        # Write to a temporary file first, so that other processes never
+        # load a partially written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                marshal.dump((importlib.util.MAGIC_NUMBER, code, tuple(include_names)), f)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        """Remove all cached entries."""
+        for entry in os.listdir(self.directory):
+            if entry.endswith(".tplc"):
+                os.unlink(os.path.join(self.directory, entry))
+
+
+class FragmentCache:
+    """
+    A bounded in-process store for ``{% cache %}`` fragments, evicting the
+    least recently used ones.
+
+    Any object with the same `get` and `set` methods, for example one
+    backed by a store shared between processes, can be used instead.
+
+    Args:
+        maxsize (int): The maximum number of fragments to keep.
+    """
+    def __init__(self, maxsize: int = 256):
+        self.entries = LRUCache(maxsize)
+
+    def get(self, key: Any) -> str | None:
+        """Return the fragment stored under `key`, unless it expired."""
+        entry = self.entries.get(key)
+        if entry is None or (entry[1] is not None and entry[1] < time.monotonic()):
+            return None
+        return entry[0]
+
+    def set(self, key: Any, fragment: str, ttl: float | None = None) -> None:
+        """Store `fragment` under `key` for `ttl` seconds."""
+        expires = None if ttl is None else time.monotonic() + ttl
+        self.entries.set(key, (fragment, expires))
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+_fragment_cache = FragmentCache()
+
+# Types whose values are never called by dotted lookups
+_DATA_TYPES = frozenset({str, bytes, int, float, bool, type(None), dict, list,
+                         tuple, set, frozenset, datetime.date, datetime.datetime})
+
+def _never_has_attribute(cls: type, name: str) -> bool:
+    """
+    Check whether no instance of `cls` can have the attribute `name`: the
+    instances have no `__dict__`, attribute access is the generic one, and
+    the class has no attribute, slot or property of that name.
+    """
+    return (getattr(cls, "__dictoffset__", 1) == 0
+            and not hasattr(cls, "__getattr__")
+            and isinstance(cls.__getattribute__, types.WrapperDescriptorType)
+            and not hasattr(cls, name))
+
+def _dot_resolver(dots: tuple[str, ...]) -> Callable[[Any], Any]:
+    """
+    Build the lookup of ``value.<dots>`` for one place in a template.
+
+    Each name is looked up as an attribute first, then as an item, and
+    callables are called. Types which resolved a name by item and whose
+    instances can never have that attribute, like dicts, are remembered,
+    so their next lookups go straight to the item.
+    """
+    def lookup(value: Any, dot: str, item_types: set[type]) -> Any:
+        cls = type(value)
+        if cls in item_types:
+            try:
+                value = value[dot]
+            except (TypeError, KeyError):
+                raise TempliteValueError(f"Cannot resolve {dot} in {value}")
+        else:
+            try:
+                value = getattr(value, dot)
+            except AttributeError:
+                try:
+                    value = value[dot]
+                except (TypeError, KeyError):
+                    raise TempliteValueError(f"Cannot resolve {dot} in {value}")
+                if _never_has_attribute(cls, dot):
+                    item_types.add(cls)
+        if type(value) not in _DATA_TYPES and callable(value):
+            value = value()
+        return value
+
+    if len(dots) == 1:
+        # The common ``{{ row.name }}``, without looping over the names
+        (dot,), item_types = dots, set()
+
+        def resolve(value: Any) -> Any:
+            if type(value) in item_types:
+                try:
+                    value = value[dot]
+                except (TypeError, KeyError):
+                    raise TempliteValueError(f"Cannot resolve {dot} in {value}")
+                if type(value) not in _DATA_TYPES and callable(value):
+                    value = value()
+                return value
+            return lookup(value, dot, item_types)
+    else:
+        by_item = [(dot, set()) for dot in dots]
+
+        def resolve(value: Any) -> Any:
+            for dot, item_types in by_item:
+                value = lookup(value, dot, item_types)
+            return value
+
+    return resolve
+
+
 class Templite:
     """A simple template renderer. Extended coverage.py/templite
     with extra features:
@@ -95,26 +344,100 @@ class Templite:
     def __init__(self,
                  text: str,
                  loader: TemplateLoader | None = None,
-                 *contexts: dict[str, Any]) -> None:  # noqa: C901
+                 *contexts: dict[str, Any],
+                 engine: TemplateEngine | None = None,
+                 name: str | None = None,
+                 code_cache: TemplateBytecodeCache | None = None,
+                 strict: bool = False,
+                 fragment_cache: FragmentCache | None = None,
+                 _including: tuple[str, ...] = ()) -> None:
         """
         Construct a Templite with the given `text`.
 
         `contexts` are dictionaries of values to use for future renderings.
         The `loader` is an optional TemplateLoader for handling {% include %}
-        directives.
+        directives. Included templates are compiled along with this one,
+        through the `engine` cache when one is given, and `dependencies`
+        holds the names of all templates included directly or indirectly.
+        A `code_cache` spares compiling templates seen before.
+
+        Each ``{{ a.b.c }}`` compiles to a lookup of its own, which tries
+        attributes, then items, and calls callables, remembering which types
+        resolve by item. With `strict`, dotted names compile straight to a
+        subscript for dicts and to attribute access otherwise, and callables
+        are not called.
+
+        ``{% cache key ttl %}...{% endcache %}`` blocks are stored in
+        `fragment_cache`, by default one shared by all templates, under the
+        value of `key` for `ttl` seconds, or until evicted if no ttl is
+        given. The body of a block is skipped while it is cached.
         """
         self.context = {}
         for context in contexts:
             self.context.update(context)
 
         self.loader = loader  # Optional loader for managing includes
+        self.engine = engine
+        self.name = name
+        self.strict = strict
+        self.fragment_cache = fragment_cache or _fragment_cache
+        self.dependencies: set[str] = set()
+        if name is not None:
+            _including += (name,)
 
         self.all_vars: set[str] = set()
         self.loop_vars: set[str] = set()
 
+        options = ("strict",) if strict else ()
+        compiled = code_cache.load(text, options) if code_cache else None
+        if compiled is None:
+            compiled = self._compile(text)
+            if code_cache:
+                code_cache.dump(text, *compiled, options)
+        code, include_names = compiled
+
+        # Link the compiled includes, so they are not read and compiled
+        # again each time they are rendered
+        namespace = {"dot_resolver": _dot_resolver,
+                     "fragment_cache": self.fragment_cache,
+                     # Stable across processes for shared cache backends,
+                     # and changing along with the template.
+                     "cache_prefix": f"{name or ''}:{hashlib.sha1(text.encode()).hexdigest()[:12]}"}
+        for index, include_name in enumerate(include_names):
+            if include_name in _including:
+                self._syntax_error(
+                    "Recursive include",
+                    " -> ".join(_including + (include_name,)))
+            if self.engine:
+                included = self.engine._load(include_name, _including)
+            else:
+                included = Templite(self.loader.get(include_name),
+                                    self.loader, name=include_name,
+                                    code_cache=code_cache, strict=strict,
+                                    fragment_cache=fragment_cache,
+                                    _including=_including)
+            self.dependencies |= {include_name, *included.dependencies}
+            namespace[f"include_{index}"] = included.render
+
+        exec(code, namespace)
+        self._render_function = namespace["render_function"]
+
+    def _compile(self, text: str) -> tuple[types.CodeType, list[str]]:  # noqa: C901
+        """
+        Compile the template `text` to a code object defining
+        `render_function`, and list the names of the included templates.
+        """
+        include_names: list[str] = []
+        self._dotted: list[tuple[str, ...]] = []
+
         # Build the function source code
         code = CodeBuilder()
-        code.add_line("def render_function(context, do_dots):")
+        resolvers_code = code.add_section()
+        # The render function is a generator, yielding the buffered output
+        # at the end of a loop iteration once `flush_size` pieces are
+        # buffered, and whatever is left at the end. `render` joins it all
+        # by never flushing early.
+        code.add_line("def render_function(context, flush_size):")
         code.indent()
         vars_code = code.add_section()
         code.add_line("result = []")
@@ -133,6 +456,8 @@ class Templite:
             del buffered[:]
 
         ops_stack = []
+        cache_sites: list[str] = []  # The ttl of each cache block
+        open_caches: list[int] = []
 
         # Split the template text into tokens
         tokens = re.split(r"(?s)({{.*?}}|{%.*?%}|{#.*?#})", text)
@@ -158,10 +483,8 @@ class Templite:
                             self._syntax_error(
                                 "TemplateLoader required for include",
                                 token)
-                        # Add a placeholder for dynamic inclusion at render time
-                        code.add_line(
-                            f"append_result(Templite(loader.get({repr(include_name)}), loader).render(context))"  # noqa
-                        )
+                        code.add_line(f"append_result(include_{len(include_names)}(context))")
+                        include_names.append(include_name)
                     elif words[0] == "if":
                         if len(words) == 2:
                             condition = self._expr_code(words[1])
@@ -188,11 +511,48 @@ class Templite:
                         self._variable(words[1], self.loop_vars)
                         code.add_line(f"for c_{words[1]} in {self._expr_code(words[3])}:")  # noqa
                         code.indent()
+                    elif words[0] == "cache":
+                        if len(words) not in (2, 3):
+                            self._syntax_error("Invalid cache block", token)
+                        if words[1][0] in "\"'":
+                            key = repr(words[1].strip("\"'"))
+                        else:
+                            key = self._expr_code(words[1])
+                        ttl = words[2] if len(words) == 3 else "None"
+                        if ttl != "None" and not re.match(r"\d+(\.\d+)?$", ttl):
+                            self._syntax_error("Invalid cache ttl", token)
+                        # On a hit the stored fragment is appended and the
+                        # body is skipped, on a miss the output of the body
+                        # is stored once it is rendered.
+                        site = len(cache_sites)
+                        cache_sites.append(ttl)
+                        open_caches.append(site)
+                        ops_stack.append("cache")
+                        code.add_line(f"fragment_key_{site} = (cache_prefix, {site}, {key})")
+                        code.add_line(f"fragment_{site} = fragment_cache.get(fragment_key_{site})")
+                        code.add_line(f"if fragment_{site} is None:")
+                        code.indent()
+                        code.add_line(f"fragment_start_{site} = len(result)")
                     elif words[0].startswith("end"):
                         end_what = words[0][3:]
                         if not ops_stack or ops_stack[-1] != end_what:
                             self._syntax_error("Mismatched end tag", token)
                         ops_stack.pop()
+                        # Output is never flushed inside a cache block, as
+                        # the whole fragment has to be in `result`
+                        if end_what == "for" and "cache" not in ops_stack:
+                            code.add_line("if flush_size and len(result) >= flush_size:")
+                            code.add_line("    yield ''.join(result)")
+                            code.add_line("    result.clear()")
+                        elif end_what == "cache":
+                            site = open_caches.pop()
+                            code.add_line(f"fragment_{site} = ''.join(result[fragment_start_{site}:])")
+                            code.add_line(f"del result[fragment_start_{site}:]")
+                            code.add_line(f"fragment_cache.set(fragment_key_{site}, fragment_{site}, "
+                                          f"{cache_sites[site]})")
+                            code.dedent()
+                            code.add_line(f"append_result(fragment_{site})")
+                            continue
                         code.dedent()
                     else:
                         self._syntax_error("Unknown tag", token)
@@ -206,11 +566,16 @@ class Templite:
         for var_name in self.all_vars - self.loop_vars:
             vars_code.add_line(f"c_{var_name} = context[{var_name!r}]")
 
-        code.add_line("return ''.join(result)")
+        for index, dots in enumerate(self._dotted):
+            resolvers_code.add_line(f"dots_{index} = dot_resolver({dots!r})")
+
+        code.add_line("yield ''.join(result)")
         code.dedent()
 
-        # Add Templite to the globals for render_function
-        self._render_function = code.get_globals({"Templite": Templite, "loader": loader})["render_function"]  # noqa
+        if ops_stack:
+            self._syntax_error("Unmatched action tag", ops_stack[-1])
+
+        return compile(str(code), f"<template {self.name or ''}>", "exec"), include_names
 
     def _expr_code(self, expr: str) -> str:
         """Generate Python code for an expression."""
@@ -223,8 +588,13 @@ class Templite:
         elif "." in expr:
             parts = expr.split(".")
             code = self._expr_code(parts[0])
-            for part in parts[1:]:
-                code = f"do_dots({code}, {repr(part)})"
+            if self.strict:
+                for part in parts[1:]:
+                    self._variable(part, set())
+                    code = f"(_v[{part!r}] if type(_v := {code}) is dict else _v.{part})"
+            else:
+                code = f"dots_{len(self._dotted)}({code})"
+                self._dotted.append(tuple(parts[1:]))
         else:
             self._variable(expr, self.all_vars)
             code = f"c_{expr}"
@@ -242,31 +612,105 @@ class Templite:
 
     def render(self, context: dict[str, Any]) -> str:
         """Render the template with a given context."""
-        return self._render_function(context, self._do_dots)
+        return "".join(self._render_function(context, 0))
 
-    def _do_dots(self, value: Any, *dots: str) -> Any:
-        """Resolve dotted expressions."""
-        for dot in dots:
-            try:
-                value = getattr(value, dot)
-            except AttributeError:
-                try:
-                    value = value[dot]
-                except (TypeError, KeyError):
-                    raise TempliteValueError(
-                            f"Cannot resolve {dot} in {value}")
-            if callable(value):
-                value = value()
-        return value
+    def stream(self, context: dict[str, Any],
+               flush_size: int = 1000) -> Iterator[str]:
+        """
+        Render the template with a given context, piece by piece.
+
+        Output is yielded at the end of a loop iteration as soon as at least
+        `flush_size` pieces of output are buffered, so large pages can be
+        sent while they are being rendered. The generator can be returned by
+        a handler, or used as the body of an `HTTPResponse`.
+        """
+        for chunk in self._render_function(context, flush_size):
+            if chunk:
+                yield chunk
 
 
 class TemplateEngine:
+    """
+    Load templates through `loader` and keep them compiled.
 
-    def __init__(self, loader: TemplateLoader):
-        self.loader = loader
+    A compiled template is reused as long as the modification time of its
+    file does not change. With `auto_reload` set to False, templates are
+    compiled once and the files are not looked at again, which suits
+    production deployments.
+
+    With a `bytecode_cache`, the compiled code is also kept on disk and
+    shared by all processes using the same cache directory. `strict` and
+    the `fragment_cache` for ``{% cache %}`` blocks are passed on to the
+    templates.
+
+    The `hits` and `compiles` counters tell how often a template was
+    served from the cache or compiled.
+    """
+    template_extensions = ('.html', '.htm', '.xml', '.txt', '.tpl')
 
-    def load(self, template: str):
-        return Templite(self.loader.get(template), self.loader)
+    def __init__(self, loader: TemplateLoader, auto_reload: bool = True,
+                 bytecode_cache: TemplateBytecodeCache | None = None,
+                 strict: bool = False, fragment_cache: FragmentCache | None = None):
+        self.loader = loader
+        self.strict = strict
+        self.fragment_cache = fragment_cache or FragmentCache()
+        self.auto_reload = auto_reload
+        self.bytecode_cache = bytecode_cache
+        self.hits = 0
+        self.compiles = 0
+        self._cache: dict[str, tuple[Templite, dict[str, int]]] = {}
+
+    def load(self, template: str) -> Templite:
+        """Return the compiled template named `template`."""
+        return self._load(template, ())
+
+    def _is_fresh(self, mtimes: dict[str, int]) -> bool:
+        try:
+            return all(self.loader.mtime(name) == mtime
+                       for name, mtime in mtimes.items())
+        except FileNotFoundError:
+            return False
+
+    def _load(self, template: str, including: tuple[str, ...]) -> Templite:
+        cached = self._cache.get(template)
+        if cached is not None and (not self.auto_reload or self._is_fresh(cached[1])):
+            self.hits += 1
+            return cached[0]
+
+        # The template and everything it includes are checked on later loads,
+        # so that editing an included file recompiles its parents
+        mtime = self.loader.mtime(template)
+        compiled = Templite(self.loader.get(template), self.loader,
+                            engine=self, name=template,
+                            code_cache=self.bytecode_cache, strict=self.strict,
+                            fragment_cache=self.fragment_cache, _including=including)
+        self.compiles += 1
+        mtimes = {template: mtime}
+        for dependency in compiled.dependencies:
+            mtimes.update(self._cache[dependency][1])
+        self._cache[template] = (compiled, mtimes)
+        return compiled
+
+    def precompile_all(self) -> list[str]:
+        """
+        Compile all templates below the loader's directory, e.g. when a
+        worker starts, and return their names. Only files with one of the
+        `template_extensions` are considered.
+        """
+        names = []
+        for root, dirs, files in os.walk(self.loader.base_path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for filename in sorted(files):
+                if filename.endswith(self.template_extensions):
+                    path = os.path.join(root, filename)
+                    name = os.path.relpath(path, self.loader.base_path)
+                    names.append(name.replace(os.sep, '/'))
+                    self.load(names[-1])
+        return names
+
+    def clear(self) -> None:
+        """Drop all compiled templates."""
+        self._cache.clear()
 
 
 class QueryDict:
@@ -386,95 +830,245 @@ class QueryDict:
         return results
 
 
+class HeaderDict:
+    """
+    A read-only, case insensitive mapping of HTTP headers.
+
+    The header names are lower cased once, when the mapping is built, so
+    every lookup is a single dict probe. Like `wsgiref.headers.Headers`,
+    indexing a missing header returns `None` and the first value wins when
+    a header is repeated.
+    """
+    __slots__ = ("_items", "_index")
+
+    def __init__(self, headers=()):
+        self._items = list(headers)
+        self._index = {}
+        for name, value in self._items:
+            self._index.setdefault(name.lower(), value)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, name):
+        return name.lower() in self._index
+
+    def __getitem__(self, name):
+        return self._index.get(name.lower())
+
+    def __str__(self):
+        return "<HeaderDict: {} headers>".format(len(self._items))
+
+    def __repr__(self):
+        return str(self)
+
+    def get(self, name, default=None):
+        return self._index.get(name.lower(), default)
+
+    def get_all(self, name):
+        """Return a list of all the values of the header `name`."""
+        name = name.lower()
+        return [value for key, value in self._items if key.lower() == name]
+
+    def keys(self):
+        return [name for name, _ in self._items]
+
+    def values(self):
+        return [value for _, value in self._items]
+
+    def items(self):
+        return list(self._items)
+
+
+class FileUpload:
+    """
+    A file uploaded as part of a `multipart/form-data` request.
+
+    The content is kept in `file`, a spooled temporary file which rolls
+    over to disk once it grows beyond the parser's `max_memory_size`.
+    """
+    def __init__(self, name, filename, content_type, file):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.file = file
+
+    def __str__(self):
+        return "<FileUpload: {} ({})>".format(self.filename, self.content_type)
+
+    def __repr__(self):
+        return str(self)
+
+    @property
+    def size(self):
+        """The size of the uploaded content in bytes."""
+        position = self.file.tell()
+        self.file.seek(0, os.SEEK_END)
+        size = self.file.tell()
+        self.file.seek(position)
+        return size
+
+    def read(self, size=-1):
+        """Read from the uploaded content."""
+        return self.file.read(size)
+
+    def save(self, destination, chunk_size=64 * 1024):
+        """
+        Copy the uploaded content to `destination`, a path or a file object
+        open for writing in binary mode.
+        """
+        self.file.seek(0)
+        if hasattr(destination, "write"):
+            shutil.copyfileobj(self.file, destination, chunk_size)
+        else:
+            with open(destination, "wb") as fp:
+                shutil.copyfileobj(self.file, fp, chunk_size)
+        self.file.seek(0)
+
+
 class StreamingMultipartParser:
+    """
+    An incremental parser for `multipart/form-data` bodies.
 
-    def __init__(self, content_type, max_memory_size=1024*1024):
+    The stream is read in chunks of `chunk_size` bytes and the boundary is
+    searched for across chunk edges, so memory use does not depend on the
+    size of the body. Every part is written to a spooled temporary file,
+    which moves to disk once it exceeds `max_memory_size`.
+
+    Raises:
+        PayloadTooLargeError: if the headers of a part exceed
+            `max_header_size`.
+    """
+    #: The largest accepted header block of a single part.
+    max_header_size = 16 * 1024
+
+    def __init__(self, content_type, max_memory_size=1024*1024, chunk_size=64*1024):
         self.boundary = self._get_boundary(content_type)
         self.max_memory_size = max_memory_size
-        
+        self.chunk_size = chunk_size
+
     def _get_boundary(self, content_type):
-        match = re.search(r'boundary=([^;]+)', content_type)
-        return match.group(1).encode('utf-8') if match else None
+        match = re.search(r'boundary=("?)([^";]+)\1', content_type)
+        return match.group(2).encode('utf-8') if match else None
 
     def parse_stream(self, stream):
-        print("Starting to parse stream")
+        """
+        Parse all the parts of `stream` in a single pass.
+
+        Returns:
+            tuple: Two dicts mapping every name to a list of values, in the
+                order they were sent: the `FileUpload` objects of the file
+                parts and the decoded values of the other fields.
+        """
         if not self.boundary:
             return {}, {}
 
-        data = stream.read()
-        parts = data.split(b'--' + self.boundary)
         files = {}
         form_data = {}
-
-        for part in parts[1:-1]:  # Skip first empty and last boundary
-            if b'\r\n\r\n' not in part:
-                continue
-
-            headers_raw, content = part.split(b'\r\n\r\n', 1)
-            headers_str = headers_raw.decode('utf-8').strip()
-
-            name = None
-            filename = None
-            for line in headers_str.splitlines():
-                if line.startswith('Content-Disposition:'):
-                    for param in line.split(';')[1:]:
-                        if '=' in param:
-                            key, value = param.strip().split('=', 1)
-                            value = value.strip('"')
-                            if key == 'name':
-                                name = value
-                            elif key == 'filename':
-                                filename = value
-
-            if filename and name:
-                files[name] = {
-                    'filename': filename,
-                    'content': content.strip(b'\r\n'),
-                    'content-type': 'application/octet-stream'
-                }
+        for headers, name, filename, sink in self._iter_parts(stream):
+            sink.seek(0)
+            if filename:
+                content_type = headers.get('Content-Type', 'application/octet-stream')
+                files.setdefault(name, []).append(
+                    FileUpload(name, filename, content_type, sink))
             elif name:
-                form_data[name] = content.strip(b'\r\n').decode('utf-8')
-
+                charset = headers.get_content_charset() or 'utf-8'
+                form_data.setdefault(name, []).append(sink.read().decode(charset, 'replace'))
         return files, form_data
-        
+
+    def _iter_parts(self, stream):
+        """
+        Yield the headers, name, filename and content of every part. The
+        content is a file object positioned at its end.
+        """
+        delimiter = b'--' + self.boundary
+        # A part ends with CRLF followed by the delimiter
+        separator = b'\r\n' + delimiter
+        buffer = bytearray()
+        eof = False
+
+        def fill():
+            nonlocal eof
+            chunk = stream.read(self.chunk_size)
+            if chunk:
+                buffer.extend(chunk)
+            else:
+                eof = True
+
+        # Skip the preamble up to the first delimiter
+        while (index := buffer.find(delimiter)) < 0:
+            if eof:
+                return
+            del buffer[:max(len(buffer) - len(delimiter), 0)]
+            fill()
+        del buffer[:index + len(delimiter)]
+
+        while True:
+            while len(buffer) < 2 and not eof:
+                fill()
+            if buffer[:2] != b'\r\n':  # b'--' closes the body
+                return
+            del buffer[:2]
+
+            while (index := buffer.find(b'\r\n\r\n')) < 0:
+                if len(buffer) > self.max_header_size:
+                    raise PayloadTooLargeError("Multipart headers too large")
+                if eof:
+                    return
+                fill()
+            if index > self.max_header_size:
+                raise PayloadTooLargeError("Multipart headers too large")
+            headers = self._parse_headers(bytes(buffer[:index]))
+            del buffer[:index + 4]
+            name, filename = self._get_content_params(headers)
+
+            sink = tempfile.SpooledTemporaryFile(max_size=self.max_memory_size)
+
+            while (index := buffer.find(separator)) < 0:
+                if eof:
+                    return
+                # Keep a tail which may hold the start of a split separator
+                keep = len(separator) - 1
+                if len(buffer) > keep:
+                    sink.write(buffer[:-keep])
+                    del buffer[:-keep]
+                fill()
+            sink.write(buffer[:index])
+            del buffer[:index + len(separator)]
+
+            yield headers, name, filename, sink
+
     def _parse_headers(self, header_data):
         parser = HeaderParser()
-        return parser.parsestr(header_data.decode('utf-8'))
-        
+        return parser.parsestr(header_data.decode('utf-8', 'replace'))
+
     def _get_content_params(self, headers):
-        content_disposition = headers.get('Content-Disposition', '')
-        params = dict(param.strip().split('=', 1) for param in 
-                     content_disposition.split(';')[1:] if '=' in param)
-        return (
-            params.get('name', '').strip('"'),
-            params.get('filename', '').strip('"')
-        )
-
-
-class FileDict:
-    def __init__(self):
-        self._files = {}
-        self._parsed = False
-        self._parser = None
-        self._stream = None
-
-    def __getitem__(self, key):
-        if not self._parsed and self._parser and self._stream:
-            self._files, _ = self._parser.parse_stream(self._stream)
-            self._parsed = True
-        return self._files[key]
+        name = headers.get_param('name', header='Content-Disposition')
+        filename = headers.get_filename()
+        if isinstance(name, tuple):  # RFC 2231 encoded
+            name = email.utils.collapse_rfc2231_value(name)
+        return name or '', filename or ''
 
-    def __contains__(self, key):
-        if not self._parsed and self._parser and self._stream:
-            self._files, _ = self._parser.parse_stream(self._stream)
-            self._parsed = True
-        return key in self._files
+
+class FileDict(QueryDict):
+    """
+    A `QueryDict` of the `FileUpload` objects of a multipart request.
+    """
+    def __str__(self):
+        return "<FileDict: {} keys>".format(len(self._data))
 
 
 class HTTPRequest:
     """
     A request object, representing all the portions of the HTTP request.
 
+    Requests built by `from_wsgi` only read the method, path and query
+    string from the WSGI environ up front. Headers, cookies, the URI, host,
+    port and the body are computed on first access and then memoized.
+
     Args:
         uri (str): The URI being requested.
         method (str): The HTTP method ("GET|POST|PUT|DELETE|PATCH|HEAD")
@@ -487,7 +1081,25 @@ class HTTPRequest:
         request_protocol (str, Optional): The protocol of the request
         cookies (http.cookies.SimpleCookie, Optional): The cookies sent as
             part of the request.
+        environ (dict, Optional): A WSGI environ to take everything else from.
+        max_body_size (int, Optional): Refuse to read bodies larger than this
+            with a `PayloadTooLargeError`. Default is `None` (no limit).
+        spool_size (int, Optional): Bodies larger than this are spooled to a
+            temporary file instead of kept in memory. Default is 1 MiB.
+        path (str, Optional): The request path, taken from `uri` if absent.
+        query_string (str, Optional): The raw query string, taken from `uri`
+            if absent. It is parsed on first access to `query` or `GET`.
     """
+    __slots__ = (
+        "_environ", "method", "path", "query_string", "request_protocol",
+        "_raw_uri", "_fragment", "_headers", "_cookies", "_COOKIES",
+        "_body", "_body_stream", "_files", "_GET", "_POST", "_PUT",
+        "_query", "_query_args", "_content_length", "_if_none_match",
+        "_accept_encoding", "_max_body_size", "_spool_size", "_host", "_port",
+    )
+
+    #: Bytes read from `wsgi.input` at once.
+    chunk_size = 64 * 1024
 
     def __init__(
         self,
@@ -502,54 +1114,244 @@ class HTTPRequest:
         request_protocol="HTTP/1.0",
         cookies=None,
         files=None,
-        environ=None
+        environ=None,
+        path=None,
+        query_string=None,
+        max_body_size=None,
+        spool_size=1024 * 1024
     ):
-        self.raw_uri = uri
-        self.method = method.upper()
-        self.body = body
-        self.scheme = scheme
-        self.host = host
-        self.port = int(port)
-        self.content_length = int(content_length)
-        self.request_protocol = request_protocol
-        self._cookies = cookies or http.cookies.SimpleCookie()
-        self._body_stream = io.BytesIO(body.encode('utf-8') if isinstance(body, str) else body)
-        self.COOKIES = {}
+        bits = urllib.parse.urlsplit(uri)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        # Describe the request as a WSGI environ, so that both ways of
+        # building a request share the same lazy accessors.
+        environ = dict(environ or {})
+        environ.update({
+            "REQUEST_METHOD": method,
+            "PATH_INFO": urllib.parse.unquote(bits.path) if path is None else path,
+            "QUERY_STRING": bits.query if query_string is None else query_string,
+            "SERVER_PROTOCOL": request_protocol,
+            "SERVER_NAME": host or bits.hostname or "",
+            "SERVER_PORT": str(port),
+            "CONTENT_LENGTH": str(content_length or len(body)),
+            "wsgi.url_scheme": scheme,
+            "wsgi.input": io.BytesIO(body),
+        })
+        if bits.netloc and not host:
+            environ["HTTP_HOST"] = bits.netloc
+
+        for name, value in (headers or {}).items():
+            key = name.upper().replace("-", "_")
+            if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                key = f"HTTP_{key}"
+            environ[key] = value
+
+        self._init_environ(environ, max_body_size, spool_size)
+        self._raw_uri = uri
+        self._fragment = bits.fragment
+        self._cookies = cookies
+
+    def _init_environ(self, environ, max_body_size=None, spool_size=1024 * 1024):
         self._environ = environ
+        self._max_body_size = max_body_size
+        self._spool_size = spool_size
+        self.method = environ.get("REQUEST_METHOD", "GET").upper()
+        self.path = environ.get("PATH_INFO") or "/"
+        self.query_string = environ.get("QUERY_STRING", "")
+        self.request_protocol = environ.get("SERVER_PROTOCOL", "HTTP/1.0")
 
         # For caching.
+        self._raw_uri, self._fragment = None, ""
+        self._headers, self._cookies, self._COOKIES = None, None, None
+        self._body, self._body_stream, self._files = None, None, None
         self._GET, self._POST, self._PUT = None, None, None
+        self._query, self._query_args = None, None
+        self._content_length, self._if_none_match, self._accept_encoding = None, None, None
+        self._host, self._port = None, None
+
+    @property
+    def raw_uri(self):
+        """The full URI of the request, rebuilt from the environ."""
+        if self._raw_uri is None:
+            self._raw_uri = wsgiref.util.request_uri(self._environ)
+        return self._raw_uri
 
-        if not headers:
-            headers = {}
+    @property
+    def fragment(self):
+        return self._fragment
+
+    @property
+    def scheme(self):
+        return self._environ.get("wsgi.url_scheme") or wsgiref.util.guess_scheme(self._environ)
+
+    def _host_port(self):
+        """Split the Host header, or the server name and port, into a pair."""
+        environ = self._environ
+        host = environ.get("HTTP_HOST")
+        if host:
+            name, sep, port = host.rpartition(":")
+            if sep and port.isdigit():
+                return name, int(port)
+            return host, int(environ.get("SERVER_PORT") or 80)
+        return environ.get("SERVER_NAME", ""), int(environ.get("SERVER_PORT") or 80)
 
-        # `Headers` is specific about wanting a list of tuples, so just doing
-        # `headers.items()` isn't good enough here.
-        self.headers = wsgiref.headers.Headers(
-            [(k, v) for k, v in headers.items()]
-        )
+    @property
+    def host(self):
+        if self._host is None:
+            self._host, self._port = self._host_port()
+        return self._host
 
-        for key, morsel in self._cookies.items():
-            self.COOKIES[key] = morsel.value
+    @property
+    def port(self):
+        if self._port is None:
+            self._host, self._port = self._host_port()
+        return self._port
 
-        uri_bits = self.split_uri(self.raw_uri)
-        domain_bits = uri_bits.get("netloc", ":").split(":", 1)
+    @property
+    def content_length(self):
+        """The Content-Length header as an `int`, 0 if absent or invalid."""
+        if self._content_length is None:
+            try:
+                self._content_length = max(int(self._environ.get("CONTENT_LENGTH") or 0), 0)
+            except ValueError:
+                self._content_length = 0
+        return self._content_length
 
-        self.path = uri_bits["path"]
-        self.query = uri_bits.get("query", {})
-        self.fragment = uri_bits.get("fragment", "")
+    @property
+    def origin(self):
+        """The Origin header or `None`."""
+        return self._environ.get("HTTP_ORIGIN")
 
-        self.files = FileDict()
-        if self.content_type().startswith('multipart/form-data'):
-            print("Found multipart form request")
-            self.files._parser = StreamingMultipartParser(self.content_type())
-            self.files._stream = self._body_stream
+    @property
+    def if_none_match(self):
+        """
+        The entity tags of the If-None-Match header as a `frozenset`, with
+        the quotes and weak indicators removed.
+        """
+        if self._if_none_match is None:
+            tags = self._environ.get("HTTP_IF_NONE_MATCH", "")
+            self._if_none_match = frozenset(
+                tag.strip().removeprefix("W/").strip('"') for tag in tags.split(",") if tag.strip())
+        return self._if_none_match
+
+    @property
+    def accept_encoding(self):
+        """
+        The Accept-Encoding header as a dict of lower cased content coding
+        and its quality value, e.g. ``{"gzip": 1.0, "br": 0.5}``.
+        """
+        if self._accept_encoding is None:
+            self._accept_encoding = _parse_accept_encoding(
+                self._environ.get("HTTP_ACCEPT_ENCODING", ""))
+        return self._accept_encoding
 
-        if not self.host:
-            self.host = domain_bits[0]
+    @property
+    def headers(self):
+        """The request headers, built from the `HTTP_*` environ keys."""
+        if self._headers is None:
+            headers = []
+            for key, value in self._environ.items():
+                if key.startswith("HTTP_") and key != "HTTP_COOKIE":
+                    headers.append((key[5:].replace("_", "-").title(), value))
+                elif key in ("CONTENT_TYPE", "CONTENT_LENGTH") and value:
+                    headers.append((key.replace("_", "-").title(), value))
+            self._headers = HeaderDict(headers)
+        return self._headers
+
+    @property
+    def COOKIES(self):
+        """The cookies sent with the request as a dict of name and value."""
+        if self._COOKIES is None:
+            if self._cookies is None:
+                self._cookies = http.cookies.SimpleCookie()
+                if "HTTP_COOKIE" in self._environ:
+                    self._cookies.load(self._environ["HTTP_COOKIE"])
+            self._COOKIES = {key: morsel.value for key, morsel in self._cookies.items()}
+        return self._COOKIES
+
+    def is_too_large(self):
+        """
+        Returns:
+            bool: True if the announced body is larger than `max_body_size`.
+        """
+        return self._max_body_size is not None and self.content_length > self._max_body_size
+
+    @property
+    def stream(self):
+        """
+        The body of the request as a seekable file, rewound on every access.
+
+        It is read from `wsgi.input` on first access. Bodies up to
+        `spool_size` stay in memory, larger ones are spooled to a temporary
+        file. `body`, `POST` and `files` all read from this stream.
+        """
+        if self._body_stream is None:
+            self._body_stream = self._read_body()
+        self._body_stream.seek(0)
+        return self._body_stream
+
+    def _read_body(self):
+        if self.is_too_large():
+            raise PayloadTooLargeError(
+                f"Body of {self.content_length} bytes exceeds {self._max_body_size} bytes")
+
+        content_length = self.content_length
+        wsgi_input = self._environ.get("wsgi.input")
+
+        # StringIO & the built-in server have this attribute, but things
+        # like gunicorn do not. Give it our best effort.
+        if not content_length or wsgi_input is None or getattr(wsgi_input, "closed", False):
+            return io.BytesIO()
+
+        stream = tempfile.SpooledTemporaryFile(max_size=self._spool_size)
+        remaining = content_length
+        while remaining > 0:
+            chunk = wsgi_input.read(min(remaining, self.chunk_size))
+            if not chunk:
+                break
+            stream.write(chunk)
+            remaining -= len(chunk)
+        return stream
+
+    @property
+    def body(self):
+        """
+        The raw body of the request as bytes. For large uploads prefer
+        `stream`, which does not hold the whole body in memory.
+        """
+        if self._body is None:
+            self._body = self.stream.read()
+        return self._body
+
+    def _parse_multipart(self):
+        """
+        Parse a `multipart/form-data` body once, filling both the files and
+        the form fields. Other bodies have no files, and their form fields
+        are left to `POST`.
+        """
+        files = {}
+        if self.content_type().startswith('multipart/form-data'):
+            parser = StreamingMultipartParser(self.content_type(), self._spool_size)
+            files, form = parser.parse_stream(self.stream)
+            if self._POST is None:
+                self._POST = QueryDict(form)
+        self._files = FileDict(files)
 
-        if len(domain_bits) > 1 and domain_bits[1]:
-            self.port = int(domain_bits[1])
+    @property
+    def files(self):
+        """A `FileDict` of the uploaded files of a `multipart/form-data` request."""
+        if self._files is None:
+            self._parse_multipart()
+        return self._files
+
+    def _form(self):
+        """Parse the body as multipart or url encoded form data."""
+        if self.content_type().startswith('multipart/form-data'):
+            if self._files is None:
+                self._parse_multipart()
+            return self._POST
+        return QueryDict(self._ensure_unicode(self.body))
 
     def get_cookie(self, key, default=None, secret=None):
         """ return the content of a cookie. to read a `signed cookie`, the
@@ -603,59 +1405,22 @@ class HTTPRequest:
         return uri_data
 
     @classmethod
-    def from_wsgi(cls, environ):
+    def from_wsgi(cls, environ, max_body_size=None, spool_size=1024 * 1024):
         """
         Builds a new HttpRequest from the provided WSGI `environ`.
 
         Args:
             environ (dict): The bag of YOLO that is the WSGI environment
+            max_body_size (int, Optional): See `HTTPRequest`.
+            spool_size (int, Optional): See `HTTPRequest`.
 
         Returns:
-            HttpRequest: A fleshed out request object, based on what was
-                present.
+            HttpRequest: A request object, which reads the rest of what is
+                present in `environ` when it is first needed.
         """
-        headers = {}
-        cookies = {}
-        non_http_prefixed_headers = [
-            "CONTENT-TYPE",
-            "CONTENT-LENGTH",
-        ]
-
-        for key, value in environ.items():
-            mangled_key = key.replace("_", "-")
-
-            if mangled_key == 'HTTP-COOKIE':
-                cookies = http.cookies.SimpleCookie()
-                cookies.load(value)
-            elif mangled_key.startswith("HTTP-"):
-                headers[mangled_key[5:]] = value
-            elif mangled_key in non_http_prefixed_headers:
-                headers[mangled_key] = value
-
-        body = ""
-        wsgi_input = environ.get("wsgi.input", io.StringIO(""))
-        content_length = environ.get("CONTENT_LENGTH", 0)
-
-        if content_length not in ("", 0):
-            # StringIO & the built-in server have this attribute, but things
-            # like gunicorn do not. Give it our best effort.
-            if not getattr(wsgi_input, "closed", False):
-                body = wsgi_input.read(int(content_length))
-        else:
-            content_length = 0
-
-        return cls(
-            uri=wsgiref.util.request_uri(environ),
-            method=environ.get("REQUEST_METHOD", 'GET'),
-            headers=headers,
-            body=body,
-            scheme=wsgiref.util.guess_scheme(environ),
-            port=environ.get("SERVER_PORT", "80"),
-            content_length=content_length,
-            request_protocol=environ.get("SERVER_PROTOCOL", "HTTP/1.0"),
-            cookies=cookies,
-            environ=environ
-        )
+        request = cls.__new__(cls)
+        request._init_environ(environ, max_body_size, spool_size)
+        return request
 
     def content_type(self):
         """
@@ -664,7 +1429,7 @@ class HTTPRequest:
         Returns:
             str: The content-type header or "text/html" if it was absent.
         """
-        return self.headers.get("Content-Type", 'text/html')
+        return self._environ.get("CONTENT_TYPE") or 'text/html'
 
     def _ensure_unicode(self, body):
         raw_data = urllib.parse.parse_qs(body)
@@ -693,6 +1458,26 @@ class HTTPRequest:
 
         return revised_data
 
+    @property
+    def query(self):
+        """
+        Returns the query string parsed into a dict of lists. It is parsed
+        only once and shared by `GET` and `query_args`.
+        """
+        if self._query is None:
+            self._query = urllib.parse.parse_qs(self.query_string, keep_blank_values=True)
+        return self._query
+
+    @property
+    def query_args(self):
+        """
+        Returns the query parameters which are passed to the handler as
+        keyword arguments: the last non blank value of every parameter.
+        """
+        if self._query_args is None:
+            self._query_args = _query_kwargs(self.query)
+        return self._query_args
+
     @property
     def GET(self):
         """
@@ -708,13 +1493,14 @@ class HTTPRequest:
     def POST(self):
         """
         Returns a `QueryDict` of the POST parameters from the request body.
+        Multipart bodies are parsed in the same pass as `files`.
 
         Useless if the body isn't form-encoded data, like JSON bodies.
         """
         if self._POST is not None:
             return self._POST
 
-        self._POST = QueryDict(self._ensure_unicode(self.body))
+        self._POST = self._form()
         return self._POST
 
     @property
@@ -727,7 +1513,7 @@ class HTTPRequest:
         if self._PUT is not None:
             return self._PUT
 
-        self._PUT = QueryDict(self._ensure_unicode(self.body))
+        self._PUT = self._form()
         return self._PUT
 
     def is_secure(self):
@@ -750,26 +1536,42 @@ class HTTPRequest:
 
 
 class TrieNode:
-    def __init__(self, path="/", method="GET"):
+    """
+    A node of the routing radix tree.
+
+    The node owns the edge leading to it: `segments` is either a chain of
+    one or more static path segments, or a single dynamic ``:name``
+    segment. Static children are keyed by the first segment of their
+    edge, handlers are kept per HTTP method in `methods`.
+
+    Dynamic children are kept in `dynamic`, ordered by the priority in
+    which they are tried. A dynamic node converts the path segment with its
+    `converter`, a `catch_all` node consumes all the remaining segments.
+    """
+    __slots__ = ("segments", "children", "dynamic", "methods", "converter", "catch_all")
+
+    def __init__(self, segments=(), converter=None, catch_all=False):
+        self.segments = list(segments)
         self.children = {}
-        self.rule = path  # The path of this route
-        self.method = method  # HTTP method, e.g., GET, POST
-        self.callback = None  # The handler function
-        self.name = None  # Optional name of the route
-        self.is_dynamic = False  # Indicate if a node represents a dynamic path
-
-    def call(self, *args, **kwargs):
-        """Invoke the callback with the provided arguments."""
-        if not self.callback:
-            raise ValueError("No callback defined for this route.")
-        return self.callback(*args, **kwargs)
+        self.dynamic = ()
+        self.methods = {}
+        self.converter = converter
+        self.catch_all = catch_all
+
+    def split(self, at):
+        """Cut the edge after `at` segments and return the new upper node."""
+        head = TrieNode(self.segments[:at])
+        self.segments = self.segments[at:]
+        head.children[self.segments[0]] = self
+        return head
+
+    @property
+    def is_dynamic(self):
+        return bool(self.segments) and self.segments[0].startswith(":")
 
     def __repr__(self):
-        return (
-            f"TrieNode(path={self.rule}, method={self.method}, "
-            f"callback={self.callback.__name__ if self.callback else None}, "
-            f"is_dynamic={self.is_dynamic})"
-        )
+        handlers = {m: getattr(h, "__name__", h) for m, h in self.methods.items()}
+        return f"TrieNode(segments={self.segments}, methods={handlers})"
 
 class MethodMisMatchError(ValueError):
     pass
@@ -780,74 +1582,261 @@ class NoHandlerError(ValueError):
 class NoPathFoundError(ValueError):
     pass
 
+class PayloadTooLargeError(ValueError):
+    pass
+
+def _int_converter(value):
+    if not value.lstrip("-").isdigit():
+        raise ValueError(f"Not an integer: {value}")
+    return int(value)
+
+def _regex_converter(pattern):
+    regex = re.compile(pattern)
+
+    def converter(value):
+        if not regex.fullmatch(value):
+            raise ValueError(f"{value} does not match {pattern}")
+        return value
+
+    return converter
+
 class Router:
-    def __init__(self):
-        self.root = TrieNode(path="/")
+    """
+    A trie based router.
 
-    def add_route(self, path, handler, method="GET"):
-        """Add a route and associate it with a handler."""
-        parts = self._split_path(path)
-        current_node = self.root
-        current_path = ""
+    Dynamic segments are written as ``:name`` and passed to the handler as
+    strings. A converter can be added as ``:name<type>``, e.g. ``:id<int>``,
+    ``:key<uuid>`` or ``:slug<re:[a-z-]+>``. The segment is converted while
+    matching and a value the converter rejects does not match the route.
+    ``:rest<path>`` must be the last segment and matches all the remaining
+    path segments. More converters can be registered in `Router.converters`.
 
-        for part in parts:
-            is_dynamic = part.startswith(":")
-            key = ":" if is_dynamic else part
+    Args:
+        cache_size (int, Optional): Keep the last `cache_size` resolved
+            ``(method, path)`` pairs in an LRU cache. Default is `0`
+            (no cache). Hits and misses are counted on `Router.cache`.
+    """
+    converters = {
+        "str": str,
+        "int": _int_converter,
+        "float": float,
+        "uuid": uuid.UUID,
+    }
+
+    _segment = re.compile(r":([^<]+)(?:<(\w+)(?::(.+))?>)?$")
+
+    def __init__(self, cache_size=0):
+        self.root = TrieNode()
+        self.frozen = False
+        self._static = None
+        self.cache = LRUCache(cache_size) if cache_size else None
+
+    def freeze(self):
+        """
+        Compile the routes into lookup tables for faster matching.
+
+        Fully static routes are indexed in a flat ``{path: {method: handler}}``
+        table, so resolving them is a single dict probe. Paths with dynamic
+        segments still walk the trie. Routes can still be added or mounted
+        after freezing, the table is rebuilt on the next match.
+        """
+        self.frozen = True
+        self._compile()
 
-            if key not in current_node.children:
-                child_path = f"{current_path}/{part}" if current_path else f"/{part}"
-                current_node.children[key] = TrieNode(path=child_path)
+    def _compile(self):
+        """Build the static route table from the trie."""
+        static = {}
 
-                if is_dynamic:
-                    current_node.children[key].is_dynamic = True
+        def walk(node, parts):
+            if node.methods:
+                static["/".join(parts)] = node.methods
+            for child in node.children.values():
+                walk(child, parts + child.segments)
 
-            current_node = current_node.children[key]
-            current_path = current_node.rule
+        walk(self.root, [])
+        self._static = static
 
-        # Instead of overwriting, we add a new *method-specific* child if needed
-        method_key = f"__{method}__"
-        if method_key not in current_node.children:
-            current_node.children[method_key] = TrieNode(path=current_node.rule, method=method)
-        current_node.children[method_key].callback = handler
+    def _invalidate(self):
+        """Drop compiled lookup tables and cached matches after the trie changed."""
+        self._static = None
+        if self.cache is not None:
+            self.cache.clear()
+
+    def add_route(self, path, handler, method="GET"):
+        """Add a route and associate it with a handler."""
+        self._invalidate()
+        self._insert(self._split_path(path)).methods[method] = handler
+
+    def _insert(self, parts):
+        """Return the node for the path `parts`, creating nodes as needed."""
+        node = self.root
+        i = 0
+
+        while i < len(parts):
+            part = parts[i]
+            if part.startswith(":"):
+                node = self._insert_dynamic(node, part, is_last=i == len(parts) - 1)
+                i += 1
+                continue
+
+            child = node.children.get(part)
+            if child is None:
+                # A new branch: all following static parts become one edge
+                end = i + 1
+                while end < len(parts) and not parts[end].startswith(":"):
+                    end += 1
+                node.children[part] = TrieNode(parts[i:end])
+                node, i = node.children[part], end
+                continue
+
+            # Follow the edge as far as it matches, split it where it diverges
+            segments = child.segments
+            common = 1
+            while (common < len(segments) and i + common < len(parts)
+                   and parts[i + common] == segments[common]):
+                common += 1
+            if common < len(segments):
+                node.children[part] = child = child.split(common)
+            node, i = child, i + common
+
+        return node
+
+    def _insert_dynamic(self, node, part, is_last):
+        """Return the dynamic child of `node` for `part`, creating it if needed."""
+        match = self._segment.match(part)
+        if not match:
+            raise ValueError(f"Invalid dynamic segment: {part}")
+        _, kind, arg = match.groups()
+
+        # Segments with the same converter share a node, whatever their name
+        spec = part.partition("<")[2]
+        for child in node.dynamic:
+            if child.segments[0].partition("<")[2] == spec:
+                return child
+
+        if kind == "path":
+            if not is_last:
+                raise ValueError(f"{part} must be the last segment of a route")
+            child = TrieNode((part,), catch_all=True)
+        elif kind == "re":
+            child = TrieNode((part,), converter=_regex_converter(arg))
+        elif kind in (None, "str"):
+            child = TrieNode((part,))
+        elif kind in self.converters:
+            child = TrieNode((part,), converter=self.converters[kind])
+        else:
+            raise ValueError(f"Unknown converter in segment: {part}")
+
+        # Typed segments are tried first, then plain ones, the catch-all last
+        node.dynamic = tuple(sorted(
+            node.dynamic + (child,),
+            key=lambda c: 2 if c.catch_all else 0 if c.converter else 1))
+        return child
 
     def match(self, full_path, method="GET"):
         """Find and call the appropriate handler for a full path with query parameters."""
         path, _, query_string = full_path.partition("?")
         query_params = self._parse_query_string(query_string)
-        parts = self._split_path(path)
-        current_node = self.root
-        path_params = []
+        callback, path_params = self.resolve(path, method)
+        return callback, path_params, query_params
 
-        for part in parts:
-            if part in current_node.children:
-                current_node = current_node.children[part]
-            elif ":" in current_node.children:
-                current_node = current_node.children[":"]
-                path_params.append(part)
-            else:
-                raise NoPathFoundError(f"No route matches path: {path}")
+    def resolve(self, path, method="GET"):
+        """
+        Find the handler for `path`, which must not contain a query string.
 
-        method_key = f"__{method}__"
-        if method_key in current_node.children:
-            current_node = current_node.children[method_key]
-        else:
-            raise MethodMisMatchError(f"Method {method} not allowed for path {path}")
+        Returns:
+            tuple: The handler and a list of the dynamic path parameters.
+        """
+        if self.frozen:
+            if self._static is None:
+                self._compile()
+            methods = self._static.get(path.strip("/"))
+            if methods is not None:
+                return self._handler(methods, method, path), []
+
+        if self.cache is not None:
+            cached = self.cache.get((method, path))
+            if cached is not None:
+                return cached[0], list(cached[1])
+
+        callback, path_params = self._walk(path, method)
+        if self.cache is not None:
+            self.cache.set((method, path), (callback, tuple(path_params)))
+        return callback, path_params
+
+    def _walk(self, path, method):
+        """Resolve `path` by walking the trie edge by edge."""
+        parts = path.strip("/").split("/")
+        if "" in parts:
+            parts = [part for part in parts if part]
+        path_params = []
+        node = self._descend(self.root, parts, 0, path_params)
 
-        if not current_node.callback:
+        if node is None:
+            raise NoPathFoundError(f"No route matches path: {path}")
+        if not node.methods:
             raise NoHandlerError(f"No handler found for path: {path}")
 
-        return current_node.callback, path_params, query_params
+        return self._handler(node.methods, method, path), path_params
 
-    def print_trie(self, node=None, depth=0):
-        if node is None:
-            node = self.root
+    def _descend(self, node, parts, i, path_params):
+        """
+        Return the node `parts[i:]` leads to from `node`, or None.
 
-        indent = "  " * depth
-        handler_name = node.callback.__name__ if node.callback else None
-        print(f"{indent}{node.rule} (Method: {node.method}, Handler: {handler_name})")
+        The static edge is tried first, then each dynamic child in order,
+        backtracking when a branch dead-ends. A node without handlers is
+        only returned when no branch has one, so it can surface as a 404
+        for the path rather than for the route.
+        """
+        if i == len(parts):
+            return node
+        part = parts[i]
+        found = None
+        child = node.children.get(part)
+        if child is not None:
+            width = len(child.segments)
+            # Compare the rest of a compacted edge in one go
+            if width == 1 or parts[i:i + width] == child.segments:
+                found = self._descend(child, parts, i + width, path_params)
+                if found is not None and found.methods:
+                    return found
+        for child in node.dynamic:
+            if child.catch_all:
+                value, end = "/".join(parts[i:]), len(parts)
+            elif child.converter is None:
+                value, end = part, i + 1
+            else:
+                try:
+                    value = child.converter(part)
+                except ValueError:
+                    continue
+                end = i + 1
+            path_params.append(value)
+            result = self._descend(child, parts, end, path_params)
+            if result is not None and result.methods:
+                return result
+            path_params.pop()
+            found = found or result
+        return found
+
+    def _handler(self, methods, method, path):
+        """Pick the handler for `method`, HEAD requests fall back to GET."""
+        try:
+            return methods[method]
+        except KeyError:
+            if method == "HEAD" and "GET" in methods:
+                return methods["GET"]
+            raise MethodMisMatchError(f"Method {method} not allowed for path {path}") from None
 
-        for key, child in node.children.items():
-            self.print_trie(child, depth + 1)
+    def _iter_routes(self, node=None, parts=()):
+        """Yield the path parts and the methods of every routable node."""
+        if node is None:
+            node = self.root
+        parts = [*parts, *node.segments]
+        if node.methods:
+            yield parts, node.methods
+        for child in (*node.children.values(), *node.dynamic):
+            yield from self._iter_routes(child, parts)
 
     def mount(self, prefix: str, other_router: str):
         """
@@ -862,58 +1851,11 @@ class Router:
             prefix (str): The prefix under which to mount the other router's routes
             other_router (Router): The router instance to mount
         """
-        def merge_node(current_node, other_node, current_path):
-            # Copy the callback and method if this is a terminal node
-            if other_node.callback:
-                current_node.callback = other_node.callback
-                current_node.method = other_node.method
-
-            # Merge all children
-            for key, child in other_node.children.items():
-                if key not in current_node.children:
-                    # For dynamic routes, include the parameter name directly after ":"
-                    if key == ":":
-                        param_name = child.rule.split("/")[-1][1:]  # Remove the leading ":"
-                        display_path = f"{current_path}/:{param_name}"
-                    else:
-                        display_path = f"{current_path}/{key}" if current_path else f"/{key}"
-
-                    current_node.children[key] = TrieNode(
-                        path=display_path,
-                        method=child.method
-                    )
-                    if key == ":":
-                        current_node.children[key].is_dynamic = True
-
-                # Recursively merge the child nodes
-                merge_node(
-                    current_node.children[key],
-                    child,
-                    current_node.children[key].rule
-                )
-
-        # If prefix is None or empty, start from root
-        if not prefix:
-            merge_node(self.root, other_router.root, "")
-            return
-
-        # Clean and split the prefix
-        prefix_parts = self._split_path(prefix)
+        self._invalidate()
+        prefix_parts = self._split_path(prefix) if prefix else []
 
-        # Start from root and create/traverse the prefix path
-        current_node = self.root
-        current_path = ""
-
-        # Create nodes for the prefix path
-        for part in prefix_parts:
-            if part not in current_node.children:
-                child_path = f"{current_path}/{part}" if current_path else f"/{part}"
-                current_node.children[part] = TrieNode(path=child_path)
-            current_node = current_node.children[part]
-            current_path = current_node.rule
-
-        # Merge the other router's trie starting from this point
-        merge_node(current_node, other_router.root, current_path)
+        for parts, methods in other_router._iter_routes():
+            self._insert(prefix_parts + parts).methods.update(methods)
 
     def merge(self, other_router):
         """
@@ -931,10 +1873,11 @@ class Router:
             node = self.root
 
         indent = "  " * depth
-        handler_name = node.callback.__name__ if node.callback else None
-        print(f"{indent}{node.rule} (Method: {node.method}, Handler: {handler_name})")  # noqa
+        handlers = ", ".join(f"{method}: {getattr(handler, '__name__', handler)}"
+                             for method, handler in node.methods.items())
+        print(f"{indent}/{'/'.join(node.segments)} ({handlers})")
 
-        for child in node.children.values():
+        for child in (*node.children.values(), *node.dynamic):
             self.print_trie(child, depth + 1)
 
     def _split_path(self, path):
@@ -943,7 +1886,7 @@ class Router:
 
     def _parse_query_string(self, query_string):
         """Parse a query string into a dictionary of key-value pairs."""
-        return dict(urllib.parse.parse_qsl(query_string))
+        return _query_kwargs(urllib.parse.parse_qs(query_string, keep_blank_values=True))
 
 def _lscmp(a, b):
     '''Compares two strings in a cryptographically safe way. Runtime is not affected by length of common prefix.'''
@@ -974,6 +1917,11 @@ def _cookie_decode(data, secret, digestmod=None):
 class HTTPResponse:
     """
     A response object, to make responding to requests easier.
+
+    The `body` can be a `str` or `bytes`, or be streamed: an iterable or a
+    generator of `str` or `bytes` chunks, or a file-like object. Streamed
+    bodies are sent chunk by chunk and without a Content-Length header,
+    unless one is set explicitly.
     """
     def __init__(self, body="", status_code=200, status_line="OK", headers=None, content_type=PLAIN_TEXT):
         self.body = body
@@ -1081,13 +2029,472 @@ def redirect(request, url, code=None):
     res.set_header('Location', urljoin(request.raw_uri, url))
     return res
 
+# More ranges than this in one Range header are ignored, and the whole file
+# is sent instead, so many small ranges cannot amplify a response.
+MAX_RANGES = 16
+
+def _parse_range_header(header, size):
+    """
+    Parse a Range header into a list of ``(start, end)`` byte ranges of a
+    file of `size` bytes, `end` being exclusive. Unsatisfiable ranges are
+    dropped, and overlapping or adjacent ones are merged. `None` is
+    returned if the header is malformed or asks for more than `MAX_RANGES`
+    ranges.
+    """
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for spec in specs.split(','):
+        start, sep, end = spec.strip().partition('-')
+        try:
+            if not sep:
+                return None
+            if not start:  # The last `end` bytes
+                start, end = max(0, size - int(end)), size
+            else:
+                start, end = int(start), min(int(end) + 1, size) if end else size
+        except ValueError:
+            return None
+        if 0 <= start < end:
+            ranges.append((start, end))
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+def _read_range(fp, offset, length, block_size=64 * 1024):
+    """Yield `length` bytes of `fp` from `offset` on, in bounded reads."""
+    fp.seek(offset)
+    while length > 0:
+        chunk = fp.read(min(length, block_size))
+        if not chunk:
+            break
+        length -= len(chunk)
+        yield chunk
+
+def _if_range_matches(if_range, etag, mtime):
+    """
+    Check the If-Range validator, an entity tag or a date, against the file.
+    A date never matches when `mtime` is `None`.
+    """
+    if if_range.startswith(('"', 'W/')):
+        return if_range.strip('"') == etag
+    return mtime is not None and parse_date(if_range) == int(mtime)
+
+def _range_response(request, filename, headers, ranges, size):
+    """Build a 206 response with a single range or multipart/byteranges."""
+    if len(ranges) == 1:
+        (start, end), = ranges
+        headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+        parts, closing = [b''], b''
+    else:
+        boundary = uuid.uuid4().hex
+        part_type = headers['Content-Type']
+        parts = [(f'\r\n--{boundary}\r\nContent-Type: {part_type}\r\n'
+                  f'Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n'
+                  ).encode('latin-1') for start, end in ranges]
+        closing = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+        headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+
+    length = sum(map(len, parts)) + sum(e - s for s, e in ranges) + len(closing)
+    headers['Content-Length'] = str(length)
+
+    def body(fp):
+        # Each part is read from its offset instead of being sliced out of
+        # the file. The file is closed once the response is done.
+        with fp:
+            for head, (start, end) in zip(parts, ranges):
+                if head:
+                    yield head
+                yield from _read_range(fp, start, end - start)
+        if closing:
+            yield closing
+
+    return HTTPResponse(body(open(filename, 'rb')) if request.method != 'HEAD' else b'',
+                        206, 'Partial Content', headers=headers,
+                        content_type=('Content-Type', headers['Content-Type']))
+
+class _BytesCache:
+    """
+    A least recently used cache of `bytes` values bounded by their total
+    size, shared by threads.
+
+    Args:
+        max_bytes (int): The total size of the cached values.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value for `key` or `None`."""
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store `value`, evicting the oldest values to stay in budget."""
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if (old := self._data.pop(key, None)) is not None:
+                self.resident_bytes -= len(old)
+            self._data[key] = value
+            self.resident_bytes += len(value)
+            while self.resident_bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.resident_bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.resident_bytes = 0
+
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+class _BrotliCompressor:
+    """A brotli compressor with the interface of `zlib.compressobj`."""
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self, mode=zlib.Z_FINISH):
+        if mode == zlib.Z_FINISH:
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+class _ZstdCompressor:
+    """A zstandard compressor with the interface of `zlib.compressobj`."""
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self, mode=zlib.Z_FINISH):
+        if mode == zlib.Z_FINISH:
+            return self._compressor.flush()
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+
+# Content codings PyPette can produce, in order of preference, mapped to
+# a factory of compressors taking the compression level.
+_compressors = {}
+if brotli is not None:
+    _compressors['br'] = _BrotliCompressor
+if zstandard is not None:
+    _compressors['zstd'] = _ZstdCompressor
+_compressors['gzip'] = lambda level: zlib.compressobj(level, zlib.DEFLATED, 31)
+_compressors['deflate'] = lambda level: zlib.compressobj(level)
+
+def _compress(data, coding, level=6):
+    """Compress `data` with the content `coding`."""
+    compressor = _compressors[coding](level)
+    return compressor.compress(data) + compressor.flush()
+
+def _compress_chunks(chunks, compressor):
+    """
+    Compress an iterable of chunks, flushing after each chunk so that the
+    client receives every chunk as soon as it is produced.
+    """
+    for chunk in chunks:
+        if chunk:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+_COMPRESSIBLE_TYPES = re.compile(
+    r'^(text/|application/(javascript|json|xml|wasm|manifest\+json)|image/svg\+xml)')
+
+def _is_compressible(mimetype):
+    """Check whether content of `mimetype` is worth compressing."""
+    return bool(mimetype and _COMPRESSIBLE_TYPES.match(mimetype))
+
+def _choose_encoding(accept_encoding, codings):
+    """
+    Choose the content coding to respond with.
+
+    Args:
+        accept_encoding (dict): The accepted codings and their quality, as
+            given by `HTTPRequest.accept_encoding`.
+        codings: The available codings, in order of preference.
+
+    Returns:
+        The accepted coding with the highest quality, or `None`.
+    """
+    best, best_quality = None, 0.0
+    for coding in codings:
+        quality = accept_encoding.get(coding, accept_encoding.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class _StaticFileMeta:
+    """The cached stat result, MIME type and validators of a static file."""
+    __slots__ = ('path', 'mtime', 'size', 'stamp', 'mimetype', 'encoding',
+                 'etag', 'last_modified', 'content_length', 'checked', 'siblings')
+
+    def __init__(self, path, stats, checked):
+        self.path = path
+        self.mtime = stats.st_mtime
+        self.size = stats.st_size
+        self.stamp = (stats.st_mtime_ns, stats.st_size, stats.st_ino)
+        self.mimetype, self.encoding = mimetypes.guess_type(path)
+        etag = '%d:%d:%d:%s:%s' % (stats.st_dev, stats.st_ino, stats.st_mtime,
+                                   stats.st_size, path)
+        self.etag = hashlib.sha1(etag.encode()).hexdigest()
+        self.last_modified = email.utils.formatdate(stats.st_mtime, usegmt=True)
+        self.content_length = str(stats.st_size)
+        self.checked = checked
+        self.siblings = None
+
+
+class StaticFileCache:
+    """
+    Cache the metadata `static_file` needs for the files below `root`.
+
+    The resolved path, MIME type, ETag and Last-Modified date are computed
+    once per file. A cached entry is trusted for `ttl` seconds, after which
+    it is revalidated by a single `os.stat` and rebuilt if the file changed.
+    With the default `ttl` of 0 every hit is revalidated.
+
+    With a `max_bytes` budget, the content of files up to `max_file_size`
+    bytes is kept in memory as well, so hot small files are served without
+    being opened. The least recently served files are evicted first.
+
+    Clients accepting a compressed response are sent the ``.br`` or ``.gz``
+    sibling of a file when it is at least as new as the file itself. The
+    siblings are looked up once per version of the file, and checked along
+    with the file when its entry is revalidated. With `compress`,
+    files of a compressible type without a sibling are compressed on their
+    first request and kept within a `max_compressed_bytes` budget.
+
+    Args:
+        root (str): The directory files are served from.
+        ttl (float): Seconds an entry is used without looking at the file.
+        maxsize (int): The maximum number of files to keep metadata for.
+        max_bytes (int): The total size of cached file contents, 0 disables
+            the content cache.
+        max_file_size (int): The size of the largest file whose content is
+            cached or compressed on the fly.
+        precompressed (bool): Serve precompressed siblings.
+        compress (bool): Compress files on the fly.
+        max_compressed_bytes (int): The total size of the compressed files
+            kept in memory.
+        compress_level (int): The compression level, from 1 to 9.
+
+    An instance can be passed to `static_file` in place of the root
+    directory. Otherwise a cache with the default settings is kept for each
+    root, for up to `max_roots` roots.
+    """
+    max_roots = 32
+    _roots = LRUCache(max_roots)
+    suffixes = {'br': '.br', 'gzip': '.gz'}
+
+    def __init__(self, root, ttl=0, maxsize=1024, max_bytes=0, max_file_size=64 * 1024,
+                 precompressed=True, compress=False, max_compressed_bytes=1024 * 1024,
+                 compress_level=6):
+        self.root = os.path.join(os.path.abspath(root), '')
+        self.ttl = ttl
+        self.entries = LRUCache(maxsize)
+        self.max_file_size = max_file_size
+        self.precompressed = precompressed
+        self.compress = compress
+        self.compress_level = compress_level
+        self.contents = _BytesCache(max_bytes)
+        self.compressed = _BytesCache(max_compressed_bytes)
+
+    @property
+    def max_bytes(self):
+        return self.contents.max_bytes
+
+    @property
+    def resident_bytes(self):
+        """The size of the file contents kept in memory."""
+        return self.contents.resident_bytes
+
+    @property
+    def content_hits(self):
+        return self.contents.hits
+
+    @property
+    def content_misses(self):
+        return self.contents.misses
+
+    @property
+    def hit_ratio(self):
+        """The share of content lookups answered from memory."""
+        total = self.content_hits + self.content_misses
+        return self.content_hits / total if total else 0.0
+
+    @classmethod
+    def for_root(cls, root):
+        """Return the shared cache for the `root` directory."""
+        root = os.path.abspath(root)
+        cache = cls._roots.get(root)
+        if cache is None:
+            cache = cls(root)
+            cls._roots.set(root, cache)
+        return cache
+
+    def lookup(self, filename):
+        """
+        Return the metadata of `filename`, relative to the root.
+
+        Raises:
+            FileNotFoundError: if the file does not exist.
+            PermissionError: if the file is not readable or is outside
+                of the root.
+        """
+        now = time.monotonic()
+        meta = self.entries.get(filename)
+        if meta is not None:
+            if now - meta.checked < self.ttl:
+                return meta
+            try:
+                stats = os.stat(meta.path)
+            except OSError:
+                stats = None
+            if stats is not None and meta.stamp == (stats.st_mtime_ns, stats.st_size, stats.st_ino):
+                meta.checked = now
+                if meta.siblings and not self._siblings_unchanged(meta):
+                    meta.siblings = None
+                return meta
+
+        path = os.path.abspath(os.path.join(self.root, filename.strip('/\\')))
+        if not os.path.isfile(path):
+            raise FileNotFoundError(filename)
+        if not os.access(path, os.R_OK) or not path.startswith(self.root):
+            raise PermissionError(filename)
+        meta = _StaticFileMeta(path, os.stat(path), now)
+        self.entries.set(filename, meta)
+        return meta
+
+    def content(self, meta):
+        """
+        Return the content of the file described by `meta` from memory,
+        reading it into the cache on a miss. Returns `None` for files which
+        are not cached.
+        """
+        if not self.max_bytes or meta.size > min(self.max_file_size, self.max_bytes):
+            return None
+        if (content := self.contents.get((meta.path, meta.stamp))) is None:
+            with open(meta.path, 'rb') as fp:
+                content = fp.read()
+            self.contents.set((meta.path, meta.stamp), content)
+        return content
+
+    def _siblings(self, meta):
+        """Find the precompressed siblings of `meta` as ``{coding: meta}``."""
+        if meta.siblings is None:
+            siblings = {}
+            for coding, suffix in self.suffixes.items():
+                try:
+                    stats = os.stat(meta.path + suffix)
+                except OSError:
+                    continue
+                if stats.st_mtime >= meta.mtime and os.access(meta.path + suffix, os.R_OK):
+                    siblings[coding] = _StaticFileMeta(meta.path + suffix, stats, meta.checked)
+            meta.siblings = siblings
+        return meta.siblings
+
+    def _siblings_unchanged(self, meta):
+        """Check that the known siblings of `meta` were not changed or removed."""
+        for sibling in meta.siblings.values():
+            try:
+                stats = os.stat(sibling.path)
+            except OSError:
+                return False
+            if sibling.stamp != (stats.st_mtime_ns, stats.st_size, stats.st_ino):
+                return False
+        return True
+
+    def drop_sibling(self, meta, coding):
+        """Stop serving the `coding` sibling of `meta`, e.g. once it is gone."""
+        if meta.siblings:
+            meta.siblings.pop(coding, None)
+
+    def negotiate(self, meta, accept_encoding, compress=True):
+        """
+        Choose the representation of `meta` to send.
+
+        Returns:
+            A tuple ``(coding, variant, vary)``. `variant` is the metadata of
+            a precompressed sibling, the compressed content as `bytes`, or
+            `None` along with a `None` coding for the file itself. `vary`
+            tells whether the response depends on Accept-Encoding.
+        """
+        siblings = self._siblings(meta) if self.precompressed else {}
+        compressible = (self.compress and meta.encoding is None
+                        and _is_compressible(meta.mimetype)
+                        and meta.size <= self.max_file_size)
+        if not siblings and not compressible:
+            return None, None, False
+
+        if (coding := _choose_encoding(accept_encoding, siblings)):
+            return coding, siblings[coding], True
+        if compressible and compress and (coding := _choose_encoding(accept_encoding, _compressors)):
+            key = (meta.path, meta.stamp, coding)
+            if (content := self.compressed.get(key)) is None:
+                with open(meta.path, 'rb') as fp:
+                    content = _compress(fp.read(), coding, self.compress_level)
+                self.compressed.set(key, content)
+            return coding, content, True
+        return None, None, True
+
+    def clear(self):
+        """Forget all cached metadata and contents."""
+        self.entries.clear()
+        self.contents.clear()
+        self.compressed.clear()
+
+
+_http_date_cache = [None, None]
+
+def _http_date_now():
+    """Return the current time as an HTTP date, formatted once per second."""
+    now = int(time.time())
+    if _http_date_cache[0] != now:
+        _http_date_cache[:] = [now, email.utils.formatdate(now, usegmt=True)]
+    return _http_date_cache[1]
+
 def static_file(request, filename, root, mimetype=True, download=False, charset='UTF-8', etag=None, headers=None):
     """ Open a file in a safe way and return an instance of `HTTPResponse`
         that can be sent back to the client.
 
         :param filename: Name or path of the file to send, relative to ``root``.
         :param root: Root path for file lookups. Should be an absolute directory
-            path.
+            path. A `StaticFileCache` can be given to configure how the file
+            metadata is cached.
         :param mimetype: Provide the content-type header (default: guess from
             file extension)
         :param download: If True, ask the browser to open a `Save as...` dialog
@@ -1112,18 +2519,25 @@ def static_file(request, filename, root, mimetype=True, download=False, charset=
         possible. ``HEAD`` and ``Range`` requests (used by download managers to
         check or continue partial downloads) are also handled automatically.
     """
-    root = os.path.join(os.path.abspath(root), '')
-    filename = os.path.abspath(os.path.join(root, filename.strip('/\\')))
+    # Used to answer again without a precompressed sibling that went away
+    retry = functools.partial(static_file, request, filename, root, mimetype,
+                              download, charset, etag, headers)
+    cache = root if isinstance(root, StaticFileCache) else StaticFileCache.for_root(root)
     headers = headers.copy() if headers else {}
     getenv = request._environ.get
-    if not os.path.exists(filename) or not os.path.isfile(filename):
+    try:
+        meta = cache.lookup(filename)
+    except FileNotFoundError:
         return HTTPResponse("File does not exist.", 404, "File not found")
-    if not os.access(filename, os.R_OK) or not filename.startswith(root):
-        return HTTPError("Permission denied", 403, "Permission denied")
+    except PermissionError:
+        return HTTPResponse("Permission denied", 403, "Permission denied")
+    filename = meta.path
 
     if mimetype:
-        name = download if isinstance(download, str) else filename
-        mimetype, encoding = mimetypes.guess_type(name)
+        if isinstance(download, str):
+            mimetype, encoding = mimetypes.guess_type(download)
+        else:
+            mimetype, encoding = meta.mimetype, meta.encoding
         if encoding == 'gzip':
             mimetype = 'application/gzip'
         elif encoding: # e.g. bzip2 -> application/x-bzip2
@@ -1141,32 +2555,274 @@ def static_file(request, filename, root, mimetype=True, download=False, charset=
         download = download.replace('"','')
         headers['Content-Disposition'] = 'attachment; filename="%s"' % download
 
-    stats = os.stat(filename)
-
     if not etag:
-        etag = '%d:%d:%d:%s:%s' % (stats.st_dev, stats.st_ino, stats.st_mtime,
-                                   stats.st_size, filename)
-        etag = hashlib.sha1(etag.encode()).hexdigest()
+        etag = meta.etag
+
+    coding, variant, vary = cache.negotiate(meta, request.accept_encoding,
+                                            compress=not getenv('HTTP_RANGE'))
+    if vary:
+        headers['Vary'] = ', '.join(filter(None, (headers.get('Vary'), 'Accept-Encoding')))
+    if coding:
+        headers['Content-Encoding'] = coding
+        etag = f'{etag}-{coding}'
+    if isinstance(variant, bytes):
+        served, size = None, len(variant)
+    else:
+        served = variant or meta
+        filename, size = served.path, served.size
 
     headers['ETag'] = etag
-    headers['Last-Modified'] = email.utils.formatdate(stats.st_mtime, usegmt=True)
-    headers['Date'] = email.utils.formatdate(time.time(), usegmt=True)
+    headers['Last-Modified'] = meta.last_modified
+    headers['Date'] = _http_date_now()
     headers.setdefault('Content-Type', mimetype or 'application/octet-stream')
     headers.setdefault('Cache-Control', 'public, max-age=0')
 
-    if getenv('HTTP_IF_NONE_MATCH') == etag:
-        return HTTPResponse(status_code=304, headers=headers)
+    if etag in request.if_none_match or '*' in request.if_none_match:
+        return HTTPResponse(status_code=304, status_line="Not Modified", headers=headers)
 
     if (ims := getenv('HTTP_IF_MODIFIED_SINCE')):
         if (parsed_ims := parse_date(ims.split(';')[0].strip())) is not None:
-            if parsed_ims >= int(stats.st_mtime):
-                return HTTPResponse(status_code=304, headers=headers)
+            if parsed_ims >= int(meta.mtime):
+                return HTTPResponse(status_code=304, status_line="Not Modified", headers=headers)
+
+    # Ranges are cut from files, never from content compressed on the fly
+    if served:
+        headers['Accept-Ranges'] = 'bytes'
+    if served and (range_header := getenv('HTTP_RANGE')) and request.method in ('GET', 'HEAD'):
+        if_range = getenv('HTTP_IF_RANGE')
+        # The file itself may stand in for content compressed on the fly,
+        # only the entity tag tells which of them the client holds.
+        mtime = None if vary and coding is None else meta.mtime
+        if not if_range or _if_range_matches(if_range, etag, mtime):
+            ranges = _parse_range_header(range_header, size)
+            if ranges == []:
+                headers['Content-Range'] = f'bytes */{size}'
+                return HTTPResponse("Requested Range Not Satisfiable", 416,
+                                    "Requested Range Not Satisfiable", headers=headers)
+            if ranges:
+                try:
+                    return _range_response(request, filename, headers, ranges, size)
+                except OSError:
+                    if served is meta:
+                        raise
+                    cache.drop_sibling(meta, coding)
+                    return retry()
+
+    headers['Content-Length'] = served.content_length if served else str(size)
+    if request.method == 'HEAD':
+        body = b''
+    elif served is None:
+        body = variant
+    else:
+        try:
+            if (body := cache.content(served)) is None:
+                # The open file is streamed by PyPette, through wsgi.file_wrapper
+                # when the server provides one, and closed when the response is done.
+                body = open(filename, 'rb')
+        except OSError:
+            if served is meta:
+                raise
+            cache.drop_sibling(meta, coding)
+            return retry()
+
+    return HTTPResponse(body, 200, headers=headers, content_type=('Content-Type', mimetype))
+
+
+class _BodyIterator:
+    """
+    Iterate over a streamed response body, encoding `str` chunks.
+
+    A file-like body is read in blocks of `block_size` bytes. `close` is
+    passed on to the body, so generators and files are cleaned up when
+    the WSGI server is done with the response, and then calls `on_close`.
+    """
+    block_size = 64 * 1024
 
-    clen = str(stats.st_size)
-    headers['Content-Length'] = clen
-    body = '' if request.method == 'HEAD' else open(filename, 'rb')
+    def __init__(self, body):
+        self.body = body
+        self.on_close = None
+        if self.is_file:
+            self._chunks = self._read_blocks()
+        else:
+            self._chunks = iter(body)
+        self._first = None
 
-    return HTTPResponse(body.read(), 200, headers=headers, content_type=('Content-Type', mimetype))
+    @property
+    def is_file(self):
+        return hasattr(self.body, 'read')
+
+    def _read_blocks(self):
+        read = self.body.read
+        while chunk := read(self.block_size):
+            yield chunk
+
+    def prime(self):
+        """
+        Fetch the first chunk ahead, so that errors raised before anything
+        was produced can still be turned into an error response. Files are
+        left untouched for `wsgi.file_wrapper`.
+        """
+        if self.is_file:
+            return
+        try:
+            self._first = next(self._chunks)
+        except StopIteration:
+            self._first = b''
+            self._chunks = iter(())
+        except BaseException:
+            self.close()
+            raise
+
+    def transform(self, func):
+        """
+        Pass the chunks which were not sent yet through `func`, a generator
+        function taking and yielding `bytes`. `close` still reaches the body.
+        """
+        first, rest = self._first, self._chunks
+        self._first = None
+
+        def chunks():
+            for chunk in itertools.chain(() if first is None else (first,), rest):
+                yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+        self._chunks = func(chunks())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._first is not None:
+            chunk, self._first = self._first, None
+        else:
+            chunk = next(self._chunks)
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        return chunk
+
+    def close(self):
+        try:
+            close = getattr(self.body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            callback, self.on_close = self.on_close, None
+            if callback is not None:
+                callback()
+
+
+class ResponseCompressor:
+    """
+    Compress response bodies for the clients which accept it.
+
+    Bodies smaller than `min_size`, bodies of types which are not
+    compressible, like images or archives, and responses which already
+    have a Content-Encoding are sent as they are. Streamed bodies are
+    compressed chunk by chunk. File bodies, and the responses of
+    `static_file`, which negotiates the coding of files itself, are left
+    alone too.
+
+    Args:
+        min_size (int): The size of the smallest body worth compressing.
+        level (int): The compression level.
+        codings: The content codings to use, in order of preference.
+            Defaults to the available ones of br, zstd, gzip and deflate.
+    """
+    def __init__(self, min_size=1024, level=6, codings=None):
+        self.min_size = min_size
+        self.level = level
+        self.codings = [c for c in (codings or _compressors) if c in _compressors]
+
+    def __call__(self, env, status, headers, body):
+        """Return the headers and body to send for a response."""
+        if status[:3] in ('204', '206', '304') or env.get('REQUEST_METHOD') == 'HEAD':
+            return headers, body
+        streamed = isinstance(body, _BodyIterator)
+        if streamed and body.is_file or not streamed and len(body) < self.min_size:
+            return headers, body
+
+        content_type = 'text/html'
+        for name, value in headers:
+            name = name.lower()
+            if name in ('content-encoding', 'accept-ranges'):
+                return headers, body
+            if name == 'vary' and 'accept-encoding' in value.lower():
+                return headers, body
+            if name == 'content-type':
+                content_type = value
+        if not _is_compressible(content_type):
+            return headers, body
+
+        vary = [v for n, v in headers if n.lower() == 'vary']
+        headers = [(n, v) for n, v in headers if n.lower() != 'vary']
+        headers.append(('Vary', ', '.join(vary + ['Accept-Encoding'])))
+        coding = _choose_encoding(
+            _parse_accept_encoding(env.get('HTTP_ACCEPT_ENCODING', '')), self.codings)
+        if coding is None:
+            return headers, body
+
+        # The compressed body is a different representation, so a strong
+        # ETag of the identity body no longer applies.
+        headers = [(n, v if n.lower() != 'etag' or v.startswith('W/') else
+                    'W/' + (v if v.startswith('"') else f'"{v}"'))
+                   for n, v in headers if n.lower() != 'content-length']
+        headers.append(('Content-Encoding', coding))
+        compressor = _compressors[coding](self.level)
+        if streamed:
+            body.transform(lambda chunks: _compress_chunks(chunks, compressor))
+        else:
+            body = compressor.compress(body) + compressor.flush()
+        return headers, body
+
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+def make_json_serializer(json_encoder=json.JSONEncoder, fast=False):
+    """
+    Return a callable turning an object into JSON `bytes`.
+
+    A single instance of `json_encoder` is created and reused for all
+    responses. With `fast` and the default `json.JSONEncoder`, orjson or
+    ujson are used instead when one of them is installed. Their output is
+    not always the same: orjson writes NaN and infinity as null, and the
+    objects it refuses, like integers beyond 64 bits, are passed on to the
+    encoder.
+    """
+    encode = json_encoder().encode
+
+    def serialize(obj):
+        return encode(obj).encode()
+
+    if fast and json_encoder is json.JSONEncoder:
+        if orjson is not None:
+            def serialize_fast(obj):
+                try:
+                    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+                except orjson.JSONEncodeError:
+                    return serialize(obj)
+            return serialize_fast
+        if ujson is not None:
+            return lambda obj: ujson.dumps(obj, escape_forward_slashes=False).encode()
+    return serialize
+
+def _iter_json(encoder, obj, chunk_size=64 * 1024):
+    """Encode `obj` with `encoder.iterencode` in chunks of about `chunk_size`."""
+    buffer, size = [], 0
+    for part in encoder.iterencode(obj):
+        buffer.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield ''.join(buffer).encode()
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode()
 
 
 class Pipeline:
@@ -1208,15 +2864,35 @@ class PyPette:
     """
     A pico WSGI Application framework with an API inspired by Bottle.
     """
-    def __init__(self, json_encoder=json.JSONEncoder, template_path="views", plugins=None):
-        self.resolver = Router()
+    def __init__(self, json_encoder=json.JSONEncoder, template_path="views", plugins=None,
+                 route_cache_size=0, max_body_size=None, body_spool_size=1024 * 1024,
+                 compression=None, json_serializer=None, json_stream_size=None,
+                 template_auto_reload=True, template_cache_dir=None):
+        self.resolver = Router(cache_size=route_cache_size)
+        # `True` compresses with the defaults of `ResponseCompressor`.
+        self.compressor = ResponseCompressor() if compression is True else compression
         self.json_encoder = json_encoder
-        self.templates = TemplateEngine(TemplateLoader(template_path))
+        # A callable returning `bytes`, or "auto" for the fastest one available.
+        custom = callable(json_serializer)
+        self.json_serializer = json_serializer if custom else make_json_serializer(
+            json_encoder, fast=json_serializer == "auto")
+        # Lists of at least `json_stream_size` items are streamed with
+        # `json_encoder`, a custom serializer always gets the whole object.
+        self.json_stream_size = None if custom else json_stream_size
+        self._json_encoder = json_encoder()
+        self.max_body_size = max_body_size
+        self.body_spool_size = body_spool_size
+        self.templates = TemplateEngine(
+            TemplateLoader(template_path), template_auto_reload,
+            TemplateBytecodeCache(template_cache_dir) if template_cache_dir else None)
         self.plugin_manager = Pipeline(plugins or [])
 
     def _process_request(self, env: dict, start_response) -> HTTPRequest:
-        handler, args, query = self.resolver.match(env['PATH_INFO'], env['REQUEST_METHOD'])
-        return handler, args, query, HTTPRequest.from_wsgi(env)
+        request = HTTPRequest.from_wsgi(env, self.max_body_size, self.body_spool_size)
+        handler, args = self.resolver.resolve(request.path, request.method)
+        if request.is_too_large():
+            raise PayloadTooLargeError(f"Request body too large: {request.content_length}")
+        return handler, args, request.query_args, request
 
     def __call__(self, env, start_response):
         body, headers, status, err = b'', [], '200 OK', None
@@ -1224,45 +2900,80 @@ class PyPette:
             self.before_request(env)
             handler, args, query, request = self._process_request(env, start_response)
             response = handler(request, *args, **query)
-            if isinstance(response, (dict, list)):
-                body = json.dumps(response, cls=self.json_encoder).encode()
-                headers = [('Content-Type', 'application/json')]
-            elif isinstance(response, HTTPResponse):
-                headers = [(k, v) for k, v in response.headers.items()]
-                possible_cookies = response._cookies.output()
-                if possible_cookies:
-                    for line in possible_cookies.splitlines():
-                        headers.append(tuple(line.split(": ", 1)))
-
-                if hasattr(response.body, 'encode'):
-                    body = response.body.encode()
-                else:
-                    body = response.body
-                status = f"{response.status_code} {response.status_line}"
-            else:
-                headers = [('Content-Type', 'text/html')]
-                body = response.encode()
+            status, headers, body = self._make_response(response)
+            if isinstance(body, _BodyIterator):
+                body.prime()
         except (NoPathFoundError, NoHandlerError):
             status, headers, body = self.handle_404()
         except MethodMisMatchError:
             status, headers, body = self.handle_405()
+        except PayloadTooLargeError:
+            status, headers, body = self.handle_413()
         except Exception as err:
             status, headers, body = self.handle_exception(err)
         finally:
-            try:
-                self.after_request(env)
-            except Exception as err:
-                msg = "Error encoutered in after_request: {traceback.print_exception(err)})"
-                body += msg.encode()
-                print(msg)
-
-                status, headers, body = self.handle_exception(err)
+            if isinstance(body, _BodyIterator) and not body.is_file:
+                # Generators run while the server sends them, so the hook
+                # waits until the body is closed.
+                body.on_close = functools.partial(self.after_request, env)
+            else:
+                try:
+                    self.after_request(env)
+                except Exception as err:
+                    print(f"Error encoutered in after_request: {err}")
+                    if isinstance(body, _BodyIterator):
+                        body.close()
+                    status, headers, body = self.handle_exception(err)
 
-            headers.append(('Content-Length', str(len(body))))
-            start_response(status, headers)
             if isinstance(body, str):
                 body = body.encode('utf-8')
-            return [body]
+            if self.compressor is not None:
+                headers, body = self.compressor(env, status, headers, body)
+            streamed = isinstance(body, _BodyIterator)
+            if not streamed and not any(name.lower() == 'content-length' for name, _ in headers):
+                headers.append(('Content-Length', str(len(body))))
+            start_response(status, headers)
+
+            if env.get('REQUEST_METHOD') == 'HEAD':
+                if streamed:
+                    body.close()
+                return []
+            if streamed and body.is_file and 'wsgi.file_wrapper' in env:
+                return env['wsgi.file_wrapper'](body.body, body.block_size)
+            return body if streamed else [body]
+
+    def _make_response(self, response):
+        """Turn the return value of a handler into status, headers and body."""
+        status = '200 OK'
+        if isinstance(response, (dict, list)):
+            if self.json_stream_size is not None and isinstance(response, list) \
+                    and len(response) >= self.json_stream_size:
+                body = _BodyIterator(_iter_json(self._json_encoder, response))
+            else:
+                body = self.json_serializer(response)
+            headers = [('Content-Type', 'application/json')]
+        elif isinstance(response, HTTPResponse):
+            headers = [(k, v) for k, v in response.headers.items()]
+            possible_cookies = response._cookies.output()
+            if possible_cookies:
+                for line in possible_cookies.splitlines():
+                    headers.append(tuple(line.split(": ", 1)))
+
+            body = response.body
+            if hasattr(body, 'encode'):
+                body = body.encode()
+            elif not isinstance(body, (bytes, bytearray)):
+                body = _BodyIterator(body)
+            status = f"{response.status_code} {response.status_line}"
+        else:
+            headers = [('Content-Type', 'text/html')]
+            if hasattr(response, 'encode'):
+                body = response.encode()
+            elif isinstance(response, (bytes, bytearray)):
+                body = response
+            else:
+                body = _BodyIterator(response)
+        return status, headers, body
 
     def add_route(self, path, callable, method='GET'):
         wrapped=self.plugin_manager(callable)
@@ -1297,7 +3008,10 @@ class PyPette:
 
     def after_request(self, env):
         """This method is for the user to override.
-        Executed once after each request regardless of its outcome."""
+        Executed once after each request regardless of its outcome. For
+        bodies streamed from a generator, it runs when the WSGI server
+        closes the body, after the last chunk was sent, and errors it
+        raises can no longer change the response."""
         pass
 
     def handle_404(self):
@@ -1314,6 +3028,13 @@ class PyPette:
         body = status.encode('utf-8')
         return status, headers, body
 
+    def handle_413(self):
+        """Override this to show a more sophisticated 413 page"""
+        status = httpstatus_as_str("REQUEST_ENTITY_TOO_LARGE")
+        headers = [PLAIN_TEXT]
+        body = status.encode('utf-8')
+        return status, headers, body
+
     def handle_exception(self, exception):
         """Override this to show a more sophisticated error page"""
         exception = " ".join(traceback.format_exception(exception))
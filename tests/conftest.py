@@ -0,0 +1,40 @@
+import io
+import wsgiref.util
+
+import pytest
+
+
+def make_environ(path="/", query="", method="GET", body=b"", **extra):
+    environ = {
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "REQUEST_METHOD": method,
+        "CONTENT_LENGTH": str(len(body)) if body else "",
+        "wsgi.input": io.BytesIO(body),
+    }
+    environ.update(extra)
+    wsgiref.util.setup_testing_defaults(environ)
+    return environ
+
+
+def call(app, environ):
+    captured = {}
+
+    def start_response(status, headers):
+        captured["status"] = status
+        captured["headers"] = headers
+
+    body = b"".join(app(environ, start_response))
+    return captured["status"], captured["headers"], body
+
+
+@pytest.fixture(name="make_environ")
+def make_environ_fixture():
+    """Build a WSGI environ for a request to the app under test."""
+    return make_environ
+
+
+@pytest.fixture(name="call")
+def call_fixture():
+    """Call a WSGI app and return its status, headers and joined body."""
+    return call
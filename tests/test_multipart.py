@@ -0,0 +1,83 @@
+import io
+import tempfile
+
+import pytest
+
+from pypette import StreamingMultipartParser, FileUpload, PayloadTooLargeError
+
+BOUNDARY = "----pypette-boundary"
+
+
+def multipart(*parts):
+    body = b"preamble\r\n"
+    for headers, content in parts:
+        body += b"--" + BOUNDARY.encode() + b"\r\n"
+        body += "".join(f"{k}: {v}\r\n" for k, v in headers.items()).encode()
+        body += b"\r\n" + content + b"\r\n"
+    return body + b"--" + BOUNDARY.encode() + b"--\r\n"
+
+
+BODY = multipart(
+    ({"Content-Disposition": 'form-data; name="title"'}, b"hello world"),
+    ({"Content-Disposition": 'form-data; name="upload"; filename="a.bin"',
+      "Content-Type": "image/png"}, b"\r\n--" + b"x" * 3000 + b"\r\n"),
+)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 16])
+def test_parse_across_chunk_edges(chunk_size):
+    parser = StreamingMultipartParser(
+        f"multipart/form-data; boundary={BOUNDARY}",
+        max_memory_size=1024, chunk_size=chunk_size)
+    files, form = parser.parse_stream(io.BytesIO(BODY))
+
+    assert form == {"title": ["hello world"]}
+    [upload] = files["upload"]
+    assert isinstance(upload, FileUpload)
+    assert upload.filename == "a.bin"
+    assert upload.content_type == "image/png"
+    assert upload.size == 3006
+    assert upload.read() == b"\r\n--" + b"x" * 3000 + b"\r\n"
+    assert upload.file._rolled
+
+
+def test_small_upload_stays_in_memory_and_saves(tmp_path):
+    body = multipart(({"Content-Disposition": 'form-data; name="f"; filename="t.txt"'},
+                      b"Hello Upload"))
+    parser = StreamingMultipartParser(f'multipart/form-data; boundary="{BOUNDARY}"')
+    files, _ = parser.parse_stream(io.BytesIO(body))
+
+    [upload] = files["f"]
+    assert not upload.file._rolled
+    assert upload.content_type == "application/octet-stream"
+    upload.save(tmp_path / "t.txt")
+    assert (tmp_path / "t.txt").read_bytes() == b"Hello Upload"
+
+
+def test_truncated_body():
+    parser = StreamingMultipartParser(f"multipart/form-data; boundary={BOUNDARY}")
+    files, form = parser.parse_stream(io.BytesIO(BODY[:-200]))
+    assert form == {"title": ["hello world"]}
+    assert files == {}
+
+
+def test_large_field_is_spooled(monkeypatch):
+    sinks, spooled = [], tempfile.SpooledTemporaryFile
+    monkeypatch.setattr(tempfile, "SpooledTemporaryFile",
+                        lambda **kw: sinks.append(spooled(**kw)) or sinks[-1])
+    body = multipart(({"Content-Disposition": 'form-data; name="text"'}, b"y" * 5000))
+    parser = StreamingMultipartParser(
+        f"multipart/form-data; boundary={BOUNDARY}", max_memory_size=1024)
+    _, form = parser.parse_stream(io.BytesIO(body))
+
+    assert form == {"text": ["y" * 5000]}
+    assert [sink._rolled for sink in sinks] == [True]
+
+
+def test_oversized_part_headers():
+    body = multipart(({"Content-Disposition": 'form-data; name="a"',
+                       "X-Padding": "z" * (StreamingMultipartParser.max_header_size + 1)},
+                      b"value"))
+    parser = StreamingMultipartParser(f"multipart/form-data; boundary={BOUNDARY}")
+    with pytest.raises(PayloadTooLargeError):
+        parser.parse_stream(io.BytesIO(body))
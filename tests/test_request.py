@@ -0,0 +1,149 @@
+import json
+import os
+
+from pypette import PyPette, HTTPRequest
+
+HERE = os.path.dirname(__file__)
+
+
+def test_query_parsed_once_and_shared(make_environ, call):
+    app = PyPette(template_path=HERE)
+    seen = {}
+
+    @app.route("/search")
+    def search(request, q="", page="1", **kwargs):
+        seen["request"] = request
+        return {"q": q, "page": page, "tags": request.GET.getlist("tag")}
+
+    status, _, body = call(app, make_environ("/search", "q=pie&tag=a&tag=b&page="))
+    assert status == "200 OK"
+    assert json.loads(body) == {"q": "pie", "page": "1", "tags": ["a", "b"]}
+
+    request = seen["request"]
+    assert request.path == "/search"
+    assert request.query is request.query
+    assert request.GET._data is request.query
+    assert request.query_args == {"q": "pie", "tag": "b"}
+
+
+def test_request_from_uri():
+    request = HTTPRequest("http://example.com:8080/a/b?x=1&x=2#frag", "get")
+    assert request.method == "GET"
+    assert request.path == "/a/b"
+    assert request.query == {"x": ["1", "2"]}
+    assert request.fragment == "frag"
+    assert (request.host, request.port) == ("example.com", 8080)
+
+
+def test_request_is_lazy(make_environ):
+    environ = make_environ("/upload", "a=1", method="POST", body=b"x=1&y=2",
+                           HTTP_COOKIE="token=abc", HTTP_X_TRACE="t1",
+                           HTTP_HOST="example.com:8080",
+                           CONTENT_TYPE="application/x-www-form-urlencoded")
+    request = HTTPRequest.from_wsgi(environ)
+    assert not hasattr(request, "__dict__")
+    assert request._headers is None and request._body is None
+    assert request._COOKIES is None and request._raw_uri is None
+    assert request._host is None and request._port is None
+
+    assert request.method == "POST" and request.path == "/upload"
+    assert request.COOKIES == {"token": "abc"}
+    assert request.headers["x-trace"] == "t1"
+    assert request.body == b"x=1&y=2"
+    assert request.body is request.body
+    assert request.POST["y"] == "2"
+    assert (request.host, request.port) == ("example.com", 8080)
+    assert request._host == "example.com" and request._port == 8080
+    assert request.raw_uri == "http://example.com:8080/upload?a=1"
+
+
+def test_header_index_and_typed_accessors(make_environ):
+    request = HTTPRequest.from_wsgi(make_environ(
+        "/", HTTP_ORIGIN="https://a.example", HTTP_X_MULTI_WORD="yes",
+        HTTP_IF_NONE_MATCH='"abc", W/"def"',
+        HTTP_ACCEPT_ENCODING="gzip;q=0.8, br, identity; q=0",
+        CONTENT_TYPE="application/json", CONTENT_LENGTH="12"))
+
+    headers = request.headers
+    assert headers.get("x-multi-word") == headers["X-MULTI-WORD"] == "yes"
+    assert "content-type" in headers
+    assert headers["missing"] is None
+    assert headers.get("missing", "default") == "default"
+
+    assert request.content_type() == "application/json"
+    assert request.content_length == 12
+    assert request.origin == "https://a.example"
+    assert request.if_none_match == {"abc", "def"}
+    assert request.accept_encoding == {"gzip": 0.8, "br": 1.0, "identity": 0.0}
+    assert request.if_none_match is request.if_none_match
+
+
+def test_body_is_spooled_to_disk(make_environ):
+    payload = b"a=" + b"x" * 5000
+    request = HTTPRequest.from_wsgi(
+        make_environ("/", method="POST", body=payload,
+                     CONTENT_TYPE="application/x-www-form-urlencoded"),
+        spool_size=1024)
+
+    assert request.stream._rolled
+    assert request.stream.read() == payload
+    assert request.body == payload
+    assert request.POST["a"] == "x" * 5000
+
+    small = HTTPRequest.from_wsgi(make_environ("/", method="POST", body=b"abc"))
+    assert not small.stream._rolled
+    assert small.body == b"abc"
+
+
+def test_too_large_body_is_rejected_before_reading(make_environ, call):
+    app = PyPette(template_path=HERE, max_body_size=10)
+
+    @app.route("/upload", method="POST")
+    def upload(request):
+        return request.body.decode()
+
+    environ = make_environ("/upload", method="POST", body=b"x" * 11)
+    status, _, body = call(app, environ)
+    assert status == "413 Request Entity Too Large"
+    assert environ["wsgi.input"].tell() == 0
+
+    status, _, body = call(app, make_environ("/upload", method="POST", body=b"x" * 10))
+    assert (status, body) == ("200 OK", b"x" * 10)
+
+
+def test_multipart_form_parsed_once(make_environ):
+    boundary = "XyZ"
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="tag"\r\n\r\na\r\n'
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="tag"\r\n\r\nb\r\n'
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="doc"; filename="a.json"\r\n'
+        "Content-Type: application/json\r\n\r\n{}\r\n"
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="doc"; filename="b.txt"\r\n\r\nB\r\n'
+        f"--{boundary}--\r\n"
+    ).encode()
+    request = HTTPRequest.from_wsgi(make_environ(
+        "/", method="POST", body=body,
+        CONTENT_TYPE=f"multipart/form-data; boundary={boundary}"))
+
+    assert request.POST.getlist("tag") == ["a", "b"]
+    assert request.POST["tag"] == "a"
+    assert request._files is not None
+
+    first, second = request.files.getlist("doc")
+    assert (first.filename, first.content_type, first.read()) == ("a.json", "application/json", b"{}")
+    assert (second.filename, second.read()) == ("b.txt", b"B")
+    assert request.files["doc"] is first
+    assert "missing" not in request.files
+
+
+def test_files_do_not_replace_urlencoded_form(make_environ):
+    request = HTTPRequest.from_wsgi(make_environ(
+        "/", method="POST", body=b"a=1&b=2",
+        CONTENT_TYPE="application/x-www-form-urlencoded"))
+    assert (request.POST["a"], request.POST["b"]) == ("1", "2")
+    assert list(request.files) == []
+    assert (request.POST["a"], request.POST["b"]) == ("1", "2")
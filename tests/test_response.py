@@ -0,0 +1,226 @@
+import gzip
+import io
+import json
+import os
+import zlib
+
+import pytest
+
+from pypette import PyPette, HTTPResponse, ResponseCompressor, make_json_serializer
+
+HERE = os.path.dirname(__file__)
+
+
+def test_generator_body_is_streamed_and_closed(make_environ):
+    app = PyPette(template_path=HERE)
+    events = []
+
+    @app.route("/export")
+    def export(request):
+        def rows():
+            try:
+                for i in range(3):
+                    yield f"{i},row\n"
+            finally:
+                events.append("closed")
+        return HTTPResponse(rows(), content_type=("Content-Type", "text/csv"))
+
+    captured = {}
+    result = app(make_environ("/export"),
+                 lambda status, headers: captured.update(status=status, headers=headers))
+    assert captured["status"] == "200 OK"
+    assert "Content-Length" not in dict(captured["headers"])
+    assert next(result) == b"0,row\n"
+    result.close()
+    assert events == ["closed"]
+
+
+def test_after_request_waits_for_streamed_body(make_environ, call):
+    app = PyPette(template_path=HERE)
+    events = []
+    app.after_request = lambda env: events.append("after")
+
+    @app.route("/export")
+    def export(request):
+        def rows():
+            for i in range(2):
+                events.append(i)
+                yield f"{i}\n"
+        return rows()
+
+    app.route("/plain")(lambda request: "plain")
+
+    result = app(make_environ("/export"), lambda status, headers: None)
+    assert events == [0]
+    assert b"".join(result) == b"0\n1\n"
+    assert events == [0, 1]
+    result.close()
+    assert events == [0, 1, "after"]
+
+    assert call(app, make_environ("/plain"))[2] == b"plain"
+    assert events[-1] == "after" and len(events) == 4
+
+def test_handler_may_return_iterables_and_files(make_environ, call):
+    app = PyPette(template_path=HERE)
+
+    @app.route("/gen")
+    def gen(request):
+        return (part for part in ["a", b"b", "c"])
+
+    @app.route("/file")
+    def file(request):
+        return HTTPResponse(io.BytesIO(b"x" * 200000))
+
+    status, headers, body = call(app, make_environ("/gen"))
+    assert (status, body) == ("200 OK", b"abc")
+    assert dict(headers)["Content-Type"] == "text/html"
+
+    status, headers, body = call(app, make_environ("/file"))
+    assert body == b"x" * 200000
+
+
+def test_error_before_first_chunk_is_a_500(make_environ, call):
+    app = PyPette(template_path=HERE)
+
+    @app.route("/broken")
+    def broken(request):
+        def rows():
+            raise RuntimeError("database is gone")
+            yield "never"
+        return rows()
+
+    status, _, _ = call(app, make_environ("/broken"))
+    assert status == "500 Internal Server Error"
+
+
+def test_explicit_content_length_is_kept(make_environ, call):
+    app = PyPette(template_path=HERE)
+
+    @app.route("/sized")
+    def sized(request):
+        return HTTPResponse(iter([b"abc"]), headers={"Content-Length": "3"})
+
+    status, headers, body = call(app, make_environ("/sized"))
+    assert [v for k, v in headers if k.lower() == "content-length"] == ["3"]
+    assert body == b"abc"
+
+
+def compressing_app():
+    app = PyPette(template_path=HERE, compression=ResponseCompressor(min_size=100))
+    app.route("/table")(lambda request: "<tr><td>row</td></tr>" * 500)
+    app.route("/json")(lambda request: {"rows": list(range(500))})
+    app.route("/tiny")(lambda request: "<p>hi</p>")
+    app.route("/png")(lambda request: HTTPResponse(b"\0" * 5000, content_type=("Content-Type", "image/png")))
+
+    @app.route("/stream")
+    def stream(request):
+        return HTTPResponse((f"<tr><td>{i}</td></tr>" for i in range(1000)),
+                            content_type=("Content-Type", "text/html"))
+
+    return app
+
+
+def test_compression_negotiates_coding(make_environ, call):
+    app = compressing_app()
+    status, headers, body = call(app, make_environ("/table", HTTP_ACCEPT_ENCODING="gzip"))
+    headers = dict(headers)
+    assert headers["Content-Encoding"] == "gzip"
+    assert headers["Vary"] == "Accept-Encoding"
+    assert headers["Content-Length"] == str(len(body))
+    assert gzip.decompress(body) == b"<tr><td>row</td></tr>" * 500
+
+    _, headers, body = call(app, make_environ("/json", HTTP_ACCEPT_ENCODING="deflate, gzip;q=0.5"))
+    assert dict(headers)["Content-Encoding"] == "deflate"
+    assert json.loads(zlib.decompress(body)) == {"rows": list(range(500))}
+
+    _, headers, body = call(app, make_environ("/table", HTTP_ACCEPT_ENCODING="identity"))
+    assert "Content-Encoding" not in dict(headers)
+    assert dict(headers)["Vary"] == "Accept-Encoding"
+
+
+def test_compression_skips_small_and_compressed_types(make_environ, call):
+    app = compressing_app()
+    for path in ("/tiny", "/png"):
+        _, headers, _ = call(app, make_environ(path, HTTP_ACCEPT_ENCODING="gzip"))
+        assert "Content-Encoding" not in dict(headers)
+
+
+def test_compression_of_streamed_body(make_environ):
+    app = compressing_app()
+    captured = {}
+    result = app(make_environ("/stream", HTTP_ACCEPT_ENCODING="gzip"),
+                 lambda status, headers: captured.update(headers=dict(headers)))
+    assert captured["headers"]["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in captured["headers"]
+
+    decompressor = zlib.decompressobj(31)
+    first = decompressor.decompress(next(result))
+    assert first == b"<tr><td>0</td></tr>"
+    rest = b"".join(decompressor.decompress(chunk) for chunk in result)
+    assert first + rest == b"".join(f"<tr><td>{i}</td></tr>".encode() for i in range(1000))
+
+
+class CommaEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, set):
+            return sorted(obj)
+        return super().default(obj)
+
+
+def test_json_serializer_is_pluggable(make_environ, call):
+    calls = []
+
+    def serializer(obj):
+        calls.append(obj)
+        return b"custom"
+
+    app = PyPette(template_path=HERE, json_serializer=serializer)
+    app.route("/")(lambda request: {"a": 1})
+    assert call(app, make_environ("/"))[2] == b"custom"
+    assert calls == [{"a": 1}]
+
+
+
+def test_custom_json_serializer_is_not_streamed(make_environ, call):
+    app = PyPette(template_path=HERE, json_serializer=lambda obj: b"custom",
+                  json_stream_size=1)
+    app.route("/")(lambda request: [1, 2, 3])
+    assert call(app, make_environ("/"))[2] == b"custom"
+
+
+@pytest.mark.parametrize("obj", [{"n": 2 ** 70}, {"url": "/a/b"}, [1.5, "x"]])
+def test_fast_json_serializer_matches_json(obj):
+    serialize = make_json_serializer(fast=True)
+    assert json.loads(serialize(obj)) == obj
+    assert b"\\/" not in serialize(obj)
+
+
+def test_json_serializer_defaults_to_json(make_environ, call):
+    app = PyPette(template_path=HERE)
+    app.route("/")(lambda request: {"n": float("nan")})
+    assert call(app, make_environ("/"))[2] == b'{"n": NaN}'
+
+def test_json_encoder_instance_is_reused(make_environ, call):
+    app = PyPette(template_path=HERE, json_encoder=CommaEncoder)
+    app.route("/")(lambda request: {"tags": {"b", "a"}})
+    for _ in range(2):
+        status, headers, body = call(app, make_environ("/"))
+        assert body == b'{"tags": ["a", "b"]}'
+        assert dict(headers)["Content-Type"] == "application/json"
+
+
+def test_large_json_list_is_streamed(make_environ, call):
+    app = PyPette(template_path=HERE, json_encoder=CommaEncoder, json_stream_size=100)
+    rows = [{"id": i, "tags": {"x"}} for i in range(10000)]
+    app.route("/rows")(lambda request: rows)
+    app.route("/few")(lambda request: rows[:10])
+
+    captured = {}
+    result = app(make_environ("/rows"), lambda status, headers: captured.update(headers=dict(headers)))
+    assert "Content-Length" not in captured["headers"]
+    chunks = list(result)
+    assert len(chunks) > 1
+    assert json.loads(b"".join(chunks))[-1] == {"id": 9999, "tags": ["x"]}
+
+    _, headers, body = call(app, make_environ("/few"))
+    assert dict(headers)["Content-Length"] == str(len(body))
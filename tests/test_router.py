@@ -1,6 +1,6 @@
 import pytest
 
-from pypette import Router, MethodMisMatchError
+from pypette import Router, MethodMisMatchError, NoHandlerError, NoPathFoundError
 
 
 def greet(name="world"):
@@ -105,3 +105,198 @@ def test_router_merge():
     callback, _, _ = router1.match("/only2")
     assert callback() == "alt from router2"
 
+
+
+def test_frozen_router_matches_like_trie():
+    router = Router()
+    router.add_route("/", greet)
+    router.add_route("/hello", greet)
+    router.add_route("/hello/:name", greet)
+    router.add_route("/users/:gid/:uid", users)
+    router.freeze()
+
+    assert router._static[""] == {"GET": greet}
+    assert router._static["hello"] == {"GET": greet}
+    assert router.match("/")[0] == greet
+    assert router.match("/hello/?x=1") == (greet, [], {"x": "1"})
+    assert router.match("/hello/world") == (greet, ["world"], {})
+    assert router.match("/users/100/1000")[1] == ["100", "1000"]
+
+    with pytest.raises(MethodMisMatchError):
+        router.match("/hello", method="POST")
+
+    with pytest.raises(NoPathFoundError):
+        router.match("/nope")
+
+
+def test_frozen_router_rebuilds_after_changes():
+    router = Router()
+    router.add_route("/hello", greet)
+    router.freeze()
+    assert "bye" not in router._static
+
+    other = Router()
+    other.add_route("/bye", users)
+    router.merge(other)
+    router.add_route("/hello", users, method="POST")
+
+    assert router.match("/bye")[0] == users
+    assert router.match("/hello", method="POST")[0] == users
+    assert router._static["hello"] == {"GET": greet, "POST": users}
+
+
+def test_route_cache():
+    router = Router(cache_size=2)
+    router.add_route("/users/:gid/:uid", users)
+
+    assert router.match("/users/100/1000")[1] == ["100", "1000"]
+    assert (router.cache.hits, router.cache.misses) == (0, 1)
+    callback, path_params, _ = router.match("/users/100/1000?x=1")
+    assert callback == users and path_params == ["100", "1000"]
+    assert (router.cache.hits, router.cache.misses) == (1, 1)
+
+    router.match("/users/1/2")
+    router.match("/users/3/4")
+    assert len(router.cache) == 2
+    assert ("GET", "/users/100/1000") not in router.cache
+
+    router.add_route("/users/:gid/:uid", greet)
+    assert len(router.cache) == 0
+    assert router.match("/users/3/4")[0] == greet
+
+
+def test_route_cache_shared_by_threads():
+    import threading
+
+    router = Router(cache_size=4)
+    router.add_route("/users/:gid/:uid", users)
+    errors = []
+
+    def worker(offset):
+        try:
+            for i in range(2000):
+                router.resolve(f"/users/{offset}/{i % 16}")
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(router.cache) == 4
+
+def test_radix_compaction():
+    router = Router()
+    router.add_route("/api/v1/users/:uid", users)
+    router.add_route("/api/v1/groups", greet)
+
+    api = router.root.children["api"]
+    assert api.segments == ["api", "v1"]
+    assert sorted(api.children) == ["groups", "users"]
+    assert api.children["users"].dynamic[0].segments == [":uid"]
+
+    assert router.match("/api/v1/users/7")[1] == ["7"]
+    assert router.match("/api/v1//groups/")[0] == greet
+
+    with pytest.raises(NoPathFoundError):
+        router.match("/api/v2/groups")
+
+    with pytest.raises(NoPathFoundError):
+        router.match("/api")
+
+    with pytest.raises(NoHandlerError):
+        router.match("/api/v1")
+
+
+def test_mount_into_compacted_edge():
+    router = Router()
+    router.add_route("/app/service/status", greet)
+
+    sub = Router()
+    sub.add_route("/users/:uid", users, method="POST")
+    router.mount("/app/", sub)
+
+    assert router.root.children["app"].segments == ["app"]
+    assert router.match("/app/service/status")[0] == greet
+    assert router.match("/app/users/3", method="POST") == (users, ["3"], {})
+
+
+def test_typed_segments():
+    router = Router()
+    router.add_route("/items/:id<int>", greet)
+    router.add_route("/items/:slug<re:[a-z-]+>", users)
+    router.add_route("/items/:other", func := lambda *a: a)
+    router.add_route("/files/:rest<path>", greet)
+
+    assert router.match("/items/42") == (greet, [42], {})
+    assert router.match("/items/-3")[1] == [-3]
+    assert router.match("/items/new-item") == (users, ["new-item"], {})
+    assert router.match("/items/Mixed_1") == (func, ["Mixed_1"], {})
+    assert router.match("/files/a/b/c.txt") == (greet, ["a/b/c.txt"], {})
+
+    with pytest.raises(NoHandlerError):
+        router.match("/files")
+
+
+def test_typed_segment_rejects_value():
+    router = Router()
+    router.add_route("/users/:gid<int>/:uid<uuid>", users)
+    callback, path_params, _ = router.match(
+        "/users/7/12345678-1234-5678-1234-567812345678")
+    assert path_params[0] == 7
+    assert str(path_params[1]) == "12345678-1234-5678-1234-567812345678"
+
+    with pytest.raises(NoPathFoundError):
+        router.match("/users/seven/12345678-1234-5678-1234-567812345678")
+
+    with pytest.raises(NoPathFoundError):
+        router.match("/users/7/not-a-uuid")
+
+
+def test_dynamic_segments_backtrack():
+    router = Router()
+    router.add_route("/item/:id<int>/edit", greet)
+    router.add_route("/item/:name/view", users)
+
+    assert router.match("/item/5/edit") == (greet, [5], {})
+    assert router.match("/item/5/view") == (users, ["5"], {})
+    with pytest.raises(NoPathFoundError):
+        router.match("/item/5/delete")
+
+
+def test_static_segment_falls_back_to_catch_all():
+    router = Router()
+    router.add_route("/files/:rest<path>", greet)
+    router.add_route("/files/readme", users)
+
+    assert router.match("/files/readme") == (users, [], {})
+    assert router.match("/files/readme/extra") == (greet, ["readme/extra"], {})
+
+def test_untyped_segment_names():
+    router = Router()
+    router.add_route("/u/:user-id", greet)
+    router.add_route("/f/:id.json", users)
+
+    assert router.match("/u/moe") == (greet, ["moe"], {})
+    assert router.match("/f/42") == (users, ["42"], {})
+
+def test_invalid_typed_segments():
+    router = Router()
+    with pytest.raises(ValueError):
+        router.add_route("/a/:id<nope>", greet)
+    with pytest.raises(ValueError):
+        router.add_route("/a/:rest<path>/b", greet)
+    with pytest.raises(ValueError):
+        router.add_route("/a/:id<int", greet)
+
+
+def test_head_falls_back_to_get():
+    router = Router()
+    router.add_route("/hello", greet)
+    router.add_route("/form", users, method="POST")
+
+    assert router.match("/hello", method="HEAD")[0] == greet
+    with pytest.raises(MethodMisMatchError):
+        router.match("/form", method="HEAD")
@@ -0,0 +1,340 @@
+import pytest
+
+import os
+
+import pypette
+from pypette import PyPette, StaticFileCache, static_file
+
+HERE = os.path.dirname(__file__)
+
+
+@pytest.fixture
+def app(tmp_path):
+    (tmp_path / "style.css").write_text("body { color: red; }\n" * 1000)
+    app = PyPette(template_path=HERE)
+
+    @app.route("/static/:filename<path>")
+    def static(request, filename):
+        return static_file(request, filename, str(tmp_path))
+
+    return app
+
+
+def serve(cache, **options):
+    app = PyPette(template_path=HERE, **options)
+    app.route("/:name")(lambda request, name: static_file(request, name, cache))
+    return app
+
+
+def test_static_file_uses_file_wrapper(app, make_environ, call):
+    wrapped = []
+
+    def file_wrapper(fp, block_size):
+        wrapped.append(fp)
+        return iter(lambda: fp.read(block_size), b"")
+
+    status, headers, body = call(app, make_environ(
+        "/static/style.css", **{"wsgi.file_wrapper": file_wrapper}))
+    assert status == "200 OK"
+    assert len(body) == 21000
+    assert dict(headers)["Content-Length"] == "21000"
+    assert dict(headers)["Content-Type"] == "text/css; charset=UTF-8"
+    assert wrapped and wrapped[0].name.endswith("style.css")
+
+
+def test_static_file_without_file_wrapper(app, make_environ):
+    environ = make_environ("/static/style.css")
+    environ.pop("wsgi.file_wrapper", None)
+    captured = {}
+    result = app(environ, lambda status, headers: captured.update(headers=headers))
+    assert b"".join(result) == b"body { color: red; }\n" * 1000
+    result.close()
+    assert result.body.closed
+
+
+def test_static_file_head(app, make_environ, call):
+    status, headers, body = call(app, make_environ("/static/style.css", method="HEAD"))
+    assert status == "200 OK"
+    assert body == b""
+    assert [v for k, v in headers if k == "Content-Length"] == ["21000"]
+
+
+def test_static_file_not_found(app, make_environ, call):
+    status, _, _ = call(app, make_environ("/static/missing.css"))
+    assert status == "404 File not found"
+
+
+CONTENT = b"body { color: red; }\n" * 1000
+
+
+@pytest.mark.parametrize("spec, start, end", [
+    ("bytes=0-99", 0, 100),
+    ("bytes=20900-", 20900, 21000),
+    ("bytes=-50", 20950, 21000),
+    ("bytes=20990-30000", 20990, 21000),
+])
+def test_static_file_single_range(app, spec, start, end, make_environ, call):
+    status, headers, body = call(app, make_environ("/static/style.css", HTTP_RANGE=spec))
+    headers = dict(headers)
+    assert status == "206 Partial Content"
+    assert body == CONTENT[start:end]
+    assert headers["Content-Range"] == f"bytes {start}-{end - 1}/21000"
+    assert headers["Content-Length"] == str(end - start)
+
+
+def test_static_file_multiple_ranges(app, make_environ, call):
+    status, headers, body = call(app, make_environ(
+        "/static/style.css", HTTP_RANGE="bytes=0-4, 21-25"))
+    headers = dict(headers)
+    assert status == "206 Partial Content"
+    ctype = headers["Content-Type"]
+    assert ctype.startswith("multipart/byteranges; boundary=")
+    boundary = ctype.split("=", 1)[1].encode()
+    assert headers["Content-Length"] == str(len(body))
+    parts = body.split(b"--" + boundary)
+    assert parts[-1] == b"--\r\n"
+    assert b"Content-Range: bytes 0-4/21000\r\n\r\nbody " in parts[1]
+    assert b"Content-Range: bytes 21-25/21000\r\n\r\nbody " in parts[2]
+
+
+def test_static_file_unsatisfiable_range(app, make_environ, call):
+    status, headers, _ = call(app, make_environ("/static/style.css", HTTP_RANGE="bytes=30000-"))
+    assert status == "416 Requested Range Not Satisfiable"
+    assert dict(headers)["Content-Range"] == "bytes */21000"
+
+
+def test_static_file_if_range(app, make_environ, call):
+    _, headers, _ = call(app, make_environ("/static/style.css"))
+    headers = dict(headers)
+    assert headers["Accept-Ranges"] == "bytes"
+
+    for validator in (f'"{headers["ETag"]}"', headers["Last-Modified"]):
+        status, _, body = call(app, make_environ(
+            "/static/style.css", HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=validator))
+        assert status == "206 Partial Content"
+        assert body == CONTENT[:10]
+
+    status, _, body = call(app, make_environ(
+        "/static/style.css", HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"'))
+    assert status == "200 OK"
+    assert body == CONTENT
+
+
+def test_static_file_cache_answers_304_without_stat(tmp_path, monkeypatch, make_environ, call):
+    (tmp_path / "app.js").write_text("run();")
+    cache = StaticFileCache(str(tmp_path), ttl=60)
+    app = serve(cache)
+
+    _, headers, _ = call(app, make_environ("/app.js"))
+    etag = dict(headers)["ETag"]
+
+    stat, stats = os.stat, []
+    monkeypatch.setattr(pypette.os, "stat", lambda *a, **kw: stats.append(a) or stat(*a, **kw))
+    status, _, _ = call(app, make_environ("/app.js", HTTP_IF_NONE_MATCH=f'"{etag}"'))
+    assert status == "304 Not Modified"
+    assert not [a for a in stats if str(a[0]).endswith("app.js")]
+    assert cache.entries.hits == 1
+
+
+def test_static_file_cache_revalidates_changed_files(tmp_path):
+    (tmp_path / "public").mkdir()
+    (tmp_path / "secret").write_text("hunter2")
+    path = tmp_path / "public" / "app.js"
+    path.write_text("run();")
+    cache = StaticFileCache(str(tmp_path / "public"))
+    first = cache.lookup("app.js")
+    assert cache.lookup("app.js") is first
+
+    path.write_text("run(); run();")
+    os.utime(path, ns=(first.stamp[0] + 10**9, first.stamp[0] + 10**9))
+    second = cache.lookup("app.js")
+    assert second is not first
+    assert second.size == 13 and second.etag != first.etag
+
+    path.unlink()
+    with pytest.raises(FileNotFoundError):
+        cache.lookup("app.js")
+    with pytest.raises(PermissionError):
+        cache.lookup("../secret")
+
+
+def test_static_file_cache_per_root(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(StaticFileCache, "_roots", pypette.LRUCache(2))
+    cache = StaticFileCache.for_root("static")
+    assert StaticFileCache.for_root("./static") is cache
+    assert StaticFileCache.for_root(str(tmp_path / "static")) is cache
+
+    StaticFileCache.for_root("a")
+    StaticFileCache.for_root("b")
+    assert len(StaticFileCache._roots) == 2
+    assert StaticFileCache.for_root("static") is not cache
+
+def test_static_file_content_cache(tmp_path, monkeypatch, make_environ, call):
+    for name, size in [("a.css", 300), ("b.css", 300), ("big.js", 2000)]:
+        (tmp_path / name).write_bytes(b"x" * size)
+    cache = StaticFileCache(str(tmp_path), max_bytes=700, max_file_size=1000)
+    app = serve(cache)
+
+    assert call(app, make_environ("/a.css"))[2] == b"x" * 300
+    assert call(app, make_environ("/b.css"))[2] == b"x" * 300
+    assert cache.resident_bytes == 600
+
+    opened = []
+    real_open = open
+    monkeypatch.setattr("builtins.open", lambda *a, **kw: opened.append(a[0]) or real_open(*a, **kw))
+    status, headers, body = call(app, make_environ("/a.css"))
+    assert status == "200 OK" and body == b"x" * 300
+    assert dict(headers)["Content-Length"] == "300"
+    assert not opened
+    assert cache.content_hits == 1 and cache.content_misses == 2
+    assert cache.hit_ratio == pytest.approx(1 / 3)
+
+    # Too big to be cached, streamed from disk.
+    assert len(call(app, make_environ("/big.js"))[2]) == 2000
+    assert cache.resident_bytes == 600
+
+    # A third file evicts the least recently served one.
+    (tmp_path / "c.css").write_bytes(b"y" * 300)
+    call(app, make_environ("/c.css"))
+    assert cache.resident_bytes == 600
+    hits, misses = cache.content_hits, cache.content_misses
+    call(app, make_environ("/a.css"))
+    assert cache.content_hits == hits + 1
+    call(app, make_environ("/b.css"))
+    assert cache.content_misses == misses + 1
+
+
+@pytest.fixture
+def assets(tmp_path):
+    import gzip
+    (tmp_path / "app.js").write_text("console.log('hi');\n" * 100)
+    (tmp_path / "app.js.gz").write_bytes(gzip.compress((tmp_path / "app.js").read_bytes()))
+    (tmp_path / "plain.txt").write_text("hello world\n" * 100)
+    (tmp_path / "logo.png").write_bytes(b"\x89PNG" + b"\0" * 1000)
+    return tmp_path
+
+
+def test_static_file_precompressed_sibling(assets, make_environ, call):
+    import gzip
+    app = serve(StaticFileCache(str(assets)))
+    status, headers, body = call(app, make_environ("/app.js", HTTP_ACCEPT_ENCODING="gzip, deflate"))
+    headers = dict(headers)
+    assert status == "200 OK"
+    assert headers["Content-Encoding"] == "gzip"
+    assert headers["Vary"] == "Accept-Encoding"
+    assert headers["Content-Type"] == "text/javascript; charset=UTF-8"
+    assert headers["Content-Length"] == str(len(body))
+    assert gzip.decompress(body) == (assets / "app.js").read_bytes()
+
+    _, plain, body = call(app, make_environ("/app.js"))
+    plain = dict(plain)
+    assert "Content-Encoding" not in plain
+    assert plain["Vary"] == "Accept-Encoding"
+    assert plain["ETag"] != headers["ETag"]
+    assert body == (assets / "app.js").read_bytes()
+
+    status, _, _ = call(app, make_environ(
+        "/app.js", HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=headers["ETag"]))
+    assert status == "304 Not Modified"
+
+
+def test_static_file_ignores_stale_sibling(assets, make_environ, call):
+    os.utime(assets / "app.js.gz", (0, 0))
+    _, headers, _ = call(serve(StaticFileCache(str(assets))),
+                         make_environ("/app.js", HTTP_ACCEPT_ENCODING="gzip"))
+    assert "Content-Encoding" not in dict(headers)
+
+
+def test_static_file_compress_on_the_fly(assets, make_environ, call):
+    import gzip
+    cache = StaticFileCache(str(assets), precompressed=False, compress=True)
+    app = serve(cache)
+    for _ in range(2):
+        status, headers, body = call(app, make_environ("/plain.txt", HTTP_ACCEPT_ENCODING="gzip;q=0.5"))
+        headers = dict(headers)
+        assert headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(body) == b"hello world\n" * 100
+    assert cache.compressed.hits == 1 and cache.compressed.resident_bytes == len(body)
+
+    _, headers, _ = call(app, make_environ("/logo.png", HTTP_ACCEPT_ENCODING="gzip"))
+    assert "Content-Encoding" not in dict(headers)
+    assert "Vary" not in dict(headers)
+
+    _, headers, _ = call(app, make_environ("/plain.txt", HTTP_ACCEPT_ENCODING="gzip;q=0"))
+    assert "Content-Encoding" not in dict(headers)
+
+
+def test_static_file_ranges_skip_compressed_content(assets, make_environ, call):
+    app = serve(StaticFileCache(str(assets), precompressed=False, compress=True))
+    _, headers, _ = call(app, make_environ("/plain.txt", HTTP_ACCEPT_ENCODING="gzip"))
+    headers = dict(headers)
+    assert "Accept-Ranges" not in headers
+
+    for if_range in (headers["Last-Modified"], headers["ETag"]):
+        status, _, body = call(app, make_environ(
+            "/plain.txt", HTTP_ACCEPT_ENCODING="gzip", HTTP_RANGE="bytes=40-",
+            HTTP_IF_RANGE=if_range))
+        assert status == "200 OK"
+        assert body == b"hello world\n" * 100
+
+    status, _, body = call(app, make_environ(
+        "/plain.txt", HTTP_ACCEPT_ENCODING="gzip", HTTP_RANGE="bytes=0-4"))
+    assert status == "206 Partial Content"
+    assert body == b"hello"
+
+@pytest.mark.parametrize("max_bytes", [0, 64 * 1024])
+def test_response_compressor_leaves_static_files_alone(assets, max_bytes, make_environ, call):
+    app = serve(StaticFileCache(str(assets), max_bytes=max_bytes), compression=True)
+    for _ in range(2):
+        _, headers, body = call(app, make_environ("/plain.txt", HTTP_ACCEPT_ENCODING="gzip"))
+        headers = dict(headers)
+        assert "Content-Encoding" not in headers
+        assert not headers["ETag"].startswith("W/")
+        assert body == b"hello world\n" * 100
+
+def test_static_file_revalidates_siblings(assets, make_environ, call):
+    import gzip
+    app = serve(StaticFileCache(str(assets)))
+    environ = lambda: make_environ("/app.js", HTTP_ACCEPT_ENCODING="gzip")  # noqa: E731
+    call(app, environ())
+
+    source = (assets / "app.js").read_bytes()
+    regenerated = gzip.compress(source, compresslevel=1) + b"\0" * 64
+    (assets / "app.js.gz").write_bytes(regenerated)
+    _, headers, body = call(app, environ())
+    assert body == regenerated
+    assert dict(headers)["Content-Length"] == str(len(regenerated))
+
+    (assets / "app.js.gz").unlink()
+    status, headers, body = call(app, environ())
+    assert status == "200 OK"
+    assert "Content-Encoding" not in dict(headers)
+    assert body == source
+
+
+def test_static_file_falls_back_when_sibling_vanishes(assets, make_environ, call):
+    cache = StaticFileCache(str(assets), ttl=60)
+    app = serve(cache)
+    call(app, make_environ("/app.js", HTTP_ACCEPT_ENCODING="gzip"))
+    (assets / "app.js.gz").unlink()
+    for extra in ({}, {"HTTP_RANGE": "bytes=0-9"}):
+        status, headers, body = call(app, make_environ("/app.js", HTTP_ACCEPT_ENCODING="gzip", **extra))
+        assert "Content-Encoding" not in dict(headers)
+        assert body == (assets / "app.js").read_bytes()[:10 if extra else None]
+
+
+def test_static_file_coalesces_and_limits_ranges(app, make_environ, call):
+    status, headers, body = call(app, make_environ(
+        "/static/style.css", HTTP_RANGE="bytes=" + ",".join(["0-"] * 5000)))
+    assert status == "206 Partial Content"
+    assert dict(headers)["Content-Range"] == "bytes 0-20999/21000"
+    assert body == CONTENT
+
+    status, headers, _ = call(app, make_environ("/static/style.css", HTTP_RANGE="bytes=10-19,0-9,15-29"))
+    assert dict(headers)["Content-Range"] == "bytes 0-29/21000"
+
+    status, headers, body = call(app, make_environ(
+        "/static/style.css", HTTP_RANGE="bytes=" + ",".join(f"{i}-{i}" for i in range(0, 200, 2))))
+    assert status == "200 OK"
+    assert body == CONTENT
@@ -0,0 +1,268 @@
+import os
+
+import pytest
+
+import pypette
+
+from pypette import (PyPette, TemplateBytecodeCache, TemplateEngine, TemplateLoader,
+                     Templite, TempliteSyntaxError)
+
+
+@pytest.fixture
+def views(tmp_path):
+    (tmp_path / "page.html").write_text("<h1>{{ title }}</h1>")
+    return tmp_path
+
+
+def touch(path, text):
+    """Rewrite `path` and move its mtime forward, whatever the fs resolution."""
+    mtime = os.stat(path).st_mtime_ns
+    path.write_text(text)
+    os.utime(path, ns=(mtime + 10**9, mtime + 10**9))
+
+
+def test_engine_caches_compiled_templates(views):
+    engine = TemplateEngine(TemplateLoader(str(views)))
+    first = engine.load("page.html")
+    assert engine.load("page.html") is first
+    assert (engine.hits, engine.compiles) == (1, 1)
+    assert first.render({"title": "Hi"}) == "<h1>Hi</h1>"
+
+
+def test_engine_recompiles_changed_templates(views):
+    engine = TemplateEngine(TemplateLoader(str(views)))
+    engine.load("page.html")
+    touch(views / "page.html", "<h2>{{ title }}</h2>")
+    assert engine.load("page.html").render({"title": "Hi"}) == "<h2>Hi</h2>"
+    assert engine.compiles == 2
+
+
+def test_engine_without_auto_reload(views):
+    app = PyPette(template_path=str(views), template_auto_reload=False)
+    first = app.templates.load("page.html")
+    touch(views / "page.html", "<h2>{{ title }}</h2>")
+    assert app.templates.load("page.html") is first
+    app.templates.clear()
+    assert app.templates.load("page.html").render({"title": "Hi"}) == "<h2>Hi</h2>"
+
+
+def test_engine_missing_template(views):
+    with pytest.raises(FileNotFoundError):
+        TemplateEngine(TemplateLoader(str(views))).load("missing.html")
+
+
+def test_templite_syntax_error():
+    with pytest.raises(TempliteSyntaxError):
+        Templite("{% if %}")
+
+
+@pytest.fixture
+def nested(views):
+    (views / "layout.html").write_text("<ul>{% for item in items %}{% include 'row.html' %}{% endfor %}</ul>")
+    (views / "row.html").write_text("<li>{% include 'cell.html' %}</li>")
+    (views / "cell.html").write_text("{{ label }}")
+    return views
+
+
+def test_includes_are_linked_at_compile_time(nested, monkeypatch):
+    engine = TemplateEngine(TemplateLoader(str(nested)))
+    layout = engine.load("layout.html")
+    assert layout.dependencies == {"row.html", "cell.html"}
+    assert engine.compiles == 3
+
+    def no_read(name):
+        raise AssertionError(f"{name} read at render time")
+
+    monkeypatch.setattr(engine.loader, "get", no_read)
+    assert layout.render({"items": [1, 2], "label": "x"}) == "<ul><li>x</li><li>x</li></ul>"
+
+
+def test_editing_an_include_recompiles_parents(nested):
+    engine = TemplateEngine(TemplateLoader(str(nested)))
+    engine.load("layout.html")
+    touch(nested / "cell.html", "[{{ label }}]")
+    layout = engine.load("layout.html")
+    assert layout.render({"items": [1], "label": "x"}) == "<ul><li>[x]</li></ul>"
+    assert engine.compiles == 6
+
+
+def test_recursive_include_is_rejected(views):
+    (views / "a.html").write_text("{% include 'b.html' %}")
+    (views / "b.html").write_text("{% include 'a.html' %}")
+    with pytest.raises(TempliteSyntaxError, match="a.html -> b.html -> a.html"):
+        TemplateEngine(TemplateLoader(str(views))).load("a.html")
+    with pytest.raises(TempliteSyntaxError, match="Recursive include"):
+        Templite("{% include 'a.html' %}", TemplateLoader(str(views)))
+
+
+def test_bytecode_cache_is_shared_between_engines(nested, tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    first = TemplateEngine(TemplateLoader(str(nested)), bytecode_cache=TemplateBytecodeCache(str(cache_dir)))
+    first.load("layout.html")
+    assert len(list(cache_dir.glob("*.tplc"))) == 3
+
+    def no_compile(self, text):
+        raise AssertionError("compiled again")
+
+    monkeypatch.setattr(Templite, "_compile", no_compile)
+    second = PyPette(template_path=str(nested), template_cache_dir=str(cache_dir))
+    layout = second.templates.load("layout.html")
+    assert layout.dependencies == {"row.html", "cell.html"}
+    assert layout.render({"items": [1], "label": "x"}) == "<ul><li>x</li></ul>"
+
+
+def test_bytecode_cache_ignores_broken_entries(views, tmp_path):
+    cache = TemplateBytecodeCache(str(tmp_path / "cache"))
+    source = (views / "page.html").read_text()
+    with open(cache._path(source), "wb") as f:
+        f.write(b"garbage")
+    assert cache.load(source) is None
+    engine = TemplateEngine(TemplateLoader(str(views)), bytecode_cache=cache)
+    assert engine.load("page.html").render({"title": "Hi"}) == "<h1>Hi</h1>"
+    assert cache.load(source) is not None
+
+
+def test_precompile_all(nested):
+    (nested / "partials").mkdir()
+    (nested / "partials" / "nav.html").write_text("<nav></nav>")
+    (nested / "logo.png").write_bytes(b"\x89PNG")
+    engine = TemplateEngine(TemplateLoader(str(nested)))
+    assert engine.precompile_all() == [
+        "cell.html", "layout.html", "page.html", "row.html", "partials/nav.html"]
+    assert engine.compiles == 5
+    engine.load("partials/nav.html")
+    assert engine.hits == 3
+
+
+def test_stream_flushes_at_loop_boundaries():
+    template = Templite("<table>{% for row in rows %}<tr><td>{{ row }}</td></tr>{% endfor %}</table>")
+    rows = list(range(100))
+    chunks = list(template.stream({"rows": rows}, flush_size=10))
+    assert len(chunks) > 10
+    assert chunks[0].startswith("<table><tr>") and chunks[0].endswith("</tr>")
+    assert "".join(chunks) == template.render({"rows": rows})
+
+
+def test_stream_is_lazy():
+    def rows():
+        yield 1
+        raise AssertionError("rendered ahead")
+
+    chunks = Templite("{% for row in rows %}{{ row }},{% endfor %}").stream({"rows": rows()}, flush_size=1)
+    assert next(chunks) == "1,"
+
+
+def test_streamed_template_response(views, make_environ, call):
+    app = PyPette(template_path=str(views))
+    (views / "rows.html").write_text("{% for row in rows %}<p>{{ row }}</p>{% endfor %}")
+    app.route("/")(lambda request: app.templates.load("rows.html").stream({"rows": range(3)}, flush_size=1))
+    status, headers, body = call(app, make_environ("/"))
+    assert body == b"<p>0</p><p>1</p><p>2</p>"
+    assert "Content-Length" not in dict(headers)
+
+
+class User:
+    def __init__(self, name):
+        self.name = name
+
+    def greeting(self):
+        return f"Hi {self.name}"
+
+
+class Record(dict):
+    pass
+
+
+def test_dotted_lookups_per_call_site():
+    template = Templite("{% for row in rows %}{{ row.user.name }}/{{ row.user.greeting }};{% endfor %}")
+    labelled = Record(user={"name": "item"})
+    labelled.user = User("attr")
+    rows = [{"user": User("ann")}, {"user": {"name": "bob", "greeting": "yo"}}, labelled]
+    assert template.render({"rows": rows * 2}) == "ann/Hi ann;bob/yo;attr/Hi attr;" * 2
+
+
+def test_dotted_lookup_errors():
+    with pytest.raises(pypette.TempliteValueError):
+        Templite("{{ row.missing }}").render({"row": {"name": "x"}})
+    template = Templite("{% for row in rows %}{{ row.name }}{% endfor %}")
+    with pytest.raises(pypette.TempliteValueError):
+        template.render({"rows": [{"name": "x"}, {}]})
+
+
+def test_strict_dotted_lookups():
+    template = Templite("{{ user.name }} {{ row.user.name|upper }}", strict=True)
+    context = {"user": User("ann"), "row": {"user": {"name": "bob"}}, "upper": str.upper}
+    assert template.render(context) == "ann BOB"
+    assert Templite("{{ user.greeting }}", strict=True).render(context).startswith("<bound method")
+    with pytest.raises(KeyError):
+        Templite("{{ row.missing }}", strict=True).render(context)
+    with pytest.raises(TempliteSyntaxError):
+        Templite("{{ row.0 }}", strict=True)
+
+
+def test_cache_block_skips_body_on_hit(views):
+    renders = []
+
+    class Items:
+        def __iter__(self):
+            renders.append(1)
+            return iter([1, 2])
+
+    (views / "nav.html").write_text(
+        "<nav>{% cache user.id 60 %}{% for i in items %}{{ i }}{% endfor %}:{{ label }}{% endcache %}</nav>")
+    engine = TemplateEngine(TemplateLoader(str(views)))
+    template = engine.load("nav.html")
+    context = {"user": {"id": 1}, "items": Items(), "label": "a"}
+    assert template.render(context) == "<nav>12:a</nav>"
+    assert template.render({**context, "label": "b"}) == "<nav>12:a</nav>"
+    assert len(renders) == 1
+    assert template.render({**context, "label": "c", "user": {"id": 2}}) == "<nav>12:c</nav>"
+    assert len(renders) == 2
+    assert engine.fragment_cache.entries.hits == 1
+
+
+def test_cache_block_ttl_and_streaming(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(pypette.time, "monotonic", lambda: now[0])
+    cache = pypette.FragmentCache()
+    template = Templite(
+        "{% for row in rows %}<{{ row }}>{% endfor %}"
+        "{% cache 'footer' 10 %}{% for row in rows %}[{{ row }}]{% endfor %}{% endcache %}",
+        fragment_cache=cache)
+    assert "".join(template.stream({"rows": [1, 2]}, flush_size=1)) == "<1><2>[1][2]"
+    assert template.render({"rows": [3]}) == "<3>[1][2]"
+    now[0] += 11
+    assert template.render({"rows": [3]}) == "<3>[3]"
+
+
+def test_cache_block_syntax():
+    with pytest.raises(TempliteSyntaxError):
+        Templite("{% cache %}x{% endcache %}")
+    with pytest.raises(TempliteSyntaxError):
+        Templite("{% cache key soon %}x{% endcache %}")
+    with pytest.raises(TempliteSyntaxError):
+        Templite("{% cache key %}x")
+
+
+class Slotted(dict):
+    __slots__ = ("name",)
+
+
+class Guarded(dict):
+    __slots__ = ()
+
+    @property
+    def name(self):
+        if "hidden" in self:
+            raise AttributeError("name")
+        return "attr"
+
+
+@pytest.mark.parametrize("cls", [Slotted, Guarded])
+def test_item_lookups_are_only_cached_when_certain(cls):
+    first = cls(name="item1", hidden=True)
+    second = cls(name="item2")
+    if cls is Slotted:
+        second.name = "attr"
+    template = Templite("{% for r in rows %}{{ r.name }},{% endfor %}")
+    assert template.render({"rows": [first, second]}) == "item1,attr,"